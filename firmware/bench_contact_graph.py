@@ -0,0 +1,119 @@
+"""
+Builds a ContactGraph from synthetic tracker rows and times 1- and 2-hop
+exposure traces, next to the same 2-hop query done by filtering a pandas
+frame of all sessions (the re-scan it replaces). Direct contacts are checked
+against the pandas result first.
+
+    python bench_contact_graph.py --sessions 1000000 --devices 100000
+
+Sessions are spread over --days with random pairs and 1-30 minute durations;
+each is fed as new_contact, contact_update and contact_ended rows.
+--long-sessions adds sessions spanning all --days, which must not make
+windowed lookups scan older history.
+"""
+import argparse
+import random
+import resource
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from contact_graph import ContactGraph
+
+
+def make_sessions(num_sessions, num_devices, days, seed=0, long_sessions=0):
+    rng = np.random.default_rng(seed)
+    start = 1750000000 + np.sort(rng.uniform(0, days * 86400, num_sessions))
+    duration = rng.uniform(60, 1800, num_sessions)
+    # The first long_sessions sessions become ones lasting the whole period
+    start[:long_sessions] = 1750000000
+    duration[:long_sessions] = days * 86400
+    a = rng.integers(0, num_devices, num_sessions)
+    b = (a + rng.integers(1, num_devices, num_sessions)) % num_devices
+    rssi = rng.integers(-95, -40, num_sessions)
+    return pd.DataFrame({'a': a, 'b': b, 'start': start, 'end': start + duration,
+                         'minutes': duration / 60, 'rssi': rssi})
+
+
+def build_graph(sessions):
+    graph = ContactGraph()
+    ids = [f"{i:04X}" for i in range(int(max(sessions['a'].max(), sessions['b'].max())) + 1)]
+    for a, b, start, end, minutes, rssi in sessions.itertuples(index=False):
+        sender, contact = ids[a], ids[b]
+        graph.record(start, sender, contact, rssi, 0, 'new_contact')
+        graph.record(end, sender, contact, rssi, minutes, 'contact_update')
+        graph.record(end + 600, sender, contact, rssi, minutes, 'contact_ended')
+    return graph
+
+
+def pandas_contacts(sessions, source, start, end):
+    """Direct contacts by filtering the whole session frame"""
+    window = sessions[(sessions['end'] >= start) & (sessions['start'] <= end)]
+    first = window[(window['a'] == source) | (window['b'] == source)]
+    return (set(first['a']) | set(first['b'])) - {source}
+
+
+def pandas_trace(sessions, source, start, end, min_minutes):
+    """Two-hop trace by filtering the whole session frame, without the causal ordering"""
+    window = sessions[(sessions['end'] >= start) & (sessions['start'] <= end) & (sessions['minutes'] >= min_minutes)]
+    first = window[(window['a'] == source) | (window['b'] == source)]
+    direct = set(first['a']) | set(first['b'])
+    second = window[window['a'].isin(direct) | window['b'].isin(direct)]
+    return (set(second['a']) | set(second['b'])) - {source}
+
+
+def time_queries(fn, sources, repeat=1):
+    durations = []
+    found = []
+    for source in sources:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = fn(source)
+        durations.append((time.perf_counter() - started) / repeat)
+        found.append(len(result))
+    durations.sort()
+    return statistics.median(durations), durations[int(0.99 * (len(durations) - 1))], statistics.fmean(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--window-days', type=float, default=14, help="trace window, ending at the last session")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--pandas-queries', type=int, default=5)
+    parser.add_argument('--long-sessions', type=int, default=0, help="sessions lasting all --days")
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.sessions, args.devices, args.days, long_sessions=args.long_sessions)
+    started = time.perf_counter()
+    graph = build_graph(sessions)
+    elapsed = time.perf_counter() - started
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Built {len(graph):,} sessions over {graph.node_count:,} IDs in {elapsed:.1f} s "
+          f"({3 * args.sessions / elapsed:,.0f} rows/s), peak RSS {rss_mb:,.0f} MB")
+
+    end = float(sessions['end'].max())
+    start = end - args.window_days * 86400
+    rng = random.Random(1)
+    sources = [rng.randrange(args.devices) for _ in range(args.queries)]
+    names = [f"{source:04X}" for source in sources]
+
+    for hops in (1, 2):
+        p50, p99, found = time_queries(lambda name: graph.trace(name, start, end, hops=hops, min_minutes=5), names)
+        print(f"ContactGraph {hops}-hop trace   p50 {p50 * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms  "
+              f"({found:.0f} contacts per query)")
+    for source, name in zip(sources[:args.pandas_queries], names):
+        expected = {f"{contact:04X}" for contact in pandas_contacts(sessions, source, start, end)}
+        assert set(graph.contacts(name, start, end)) == expected, name
+    p50, p99, found = time_queries(lambda source: pandas_trace(sessions, source, start, end, 5),
+                                   sources[:args.pandas_queries])
+    print(f"pandas 2-hop filter       p50 {p50 * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms  "
+          f"({found:.0f} contacts per query)")
+
+
+if __name__ == "__main__":
+    main()
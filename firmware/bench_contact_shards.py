@@ -0,0 +1,111 @@
+"""
+Measures end-to-end contact tracking throughput against the --shards count:
+synthetic uploads go through the server's track_contacts on one thread, as
+the ContactTrackingStage runs it, until every processed row is written and
+the in-memory views are updated. --shards 0 is the single-process tracker.
+The processed files of every run are checked to hold the same rows.
+With shards the tracking thread only hands rows over, so the rate it could
+sustain with a core per shard is also shown: rows over the parent's CPU time.
+
+    python bench_contact_shards.py --uploads 400 --rows 1000 --shards 0 1 2 4
+
+Run in a scratch directory, since the server module creates its files in the
+working directory; one is made under the system temp dir per shard count.
+"""
+import argparse
+import importlib
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from ingest_log import ROOT_LOGGER
+from upload_parser import ContactRow
+
+
+def make_uploads(num_uploads, rows_per_upload, num_devices, seed=0):
+    """(arrival time, rows) per upload: one tracer's scans of devices near it, 10 s apart"""
+    rng = random.Random(seed)
+    started = datetime(2025, 7, 1, 12, 0, 0)
+    uploads = []
+    for i in range(num_uploads):
+        current_time = started + timedelta(seconds=30 * i)
+        sender = f"{rng.randrange(num_devices):04X}"
+        t = int(current_time.timestamp()) - rows_per_upload // 10 * 10
+        rows = []
+        for j in range(rows_per_upload):
+            mac = ':'.join(f"{rng.randrange(256):02x}" for _ in range(6))
+            rows.append(ContactRow(str(t + j // 10 * 10), mac, str(rng.randint(-90, -40)), 'BLE Contact Tracer',
+                                   f"{rng.randrange(num_devices):04X}", sender))
+        uploads.append((current_time, rows))
+    return uploads
+
+
+def run(uploads, num_shards, work_dir):
+    """Rows tracked, wall and parent CPU seconds taken with num_shards, and the processed rows written"""
+    os.makedirs(work_dir)
+    os.chdir(work_dir)
+    sys.modules.pop('bulk_upload_server', None)
+    server = importlib.import_module('bulk_upload_server')
+    if num_shards:
+        server.contact_shards = server.ShardedContactTracker(
+            num_shards, server.apply_shard_output,
+            sink_config=dict(csv_path=server.PROCESSED_DATA_FILE, flush_rows=server.SINK_FLUSH_ROWS))
+    else:
+        server.open_processed_sink()
+    total_rows = sum(len(rows) for _, rows in uploads)
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for current_time, rows in uploads:
+        server.track_contacts(rows, current_time)
+    if num_shards:
+        server.contact_shards.close()
+    server.close_processed_sink()
+    elapsed = time.perf_counter() - started
+    parent_cpu = time.process_time() - cpu_started
+    with open(server.PROCESSED_DATA_FILE) as f:
+        written = sorted(f.readlines()[1:])
+    return total_rows, elapsed, parent_cpu, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uploads', type=int, default=400)
+    parser.add_argument('--rows', type=int, default=1000, help="rows per upload")
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 2, 4])
+    args = parser.parse_args()
+
+    uploads = make_uploads(args.uploads, args.rows, args.devices)
+    print(f"{args.uploads} uploads of {args.rows} rows, {args.devices} devices, {os.cpu_count()} CPUs")
+    scratch = tempfile.mkdtemp(prefix='bench_shards_')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Exposure alerts are warnings; the shards inherit the level when forked
+    logging.getLogger(ROOT_LOGGER).setLevel(logging.ERROR)
+    try:
+        expected = None
+        baseline = None
+        for num_shards in args.shards:
+            total_rows, elapsed, parent_cpu, written = run(uploads, num_shards,
+                                                           os.path.join(scratch, f"shards_{num_shards}"))
+            rate = total_rows / elapsed
+            if expected is None:
+                expected = written
+            elif written != expected:
+                sys.exit(f"--shards {num_shards} wrote different rows ({len(written)} vs {len(expected)})")
+            baseline = baseline or rate
+            print(f"shards {num_shards}: {rate:10,.0f} rows/s ({rate / baseline:4.2f}x)  "
+                  f"parent CPU {parent_cpu:6.2f} s, at most {total_rows / parent_cpu:10,.0f} rows/s on enough cores  "
+                  f"{len(written):,} processed rows")
+        print("Processed rows match across shard counts")
+    finally:
+        os.chdir(os.path.dirname(scratch))
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Checks the vectorized calculate_packet_delivery_metrics against the original
+per-device iloc loop and times both on synthetic packet frames.
+
+    python bench_packet_metrics.py --sizes 100000 1000000 10000000
+
+The loop takes minutes on large frames, so it only runs up to --loop-max-rows.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from packet_analysis import calculate_packet_delivery_metrics
+
+
+def calculate_packet_delivery_metrics_loop(df):
+    """The original implementation, kept as the reference for the vectorized one"""
+    if df is None or df.empty:
+        return None
+
+    device_stats = []
+
+    for device, group in df.groupby('manufacturer_data'):
+        total_packets = len(group)
+        time_span = (group['timestamp'].max() - group['timestamp'].min()).total_seconds()
+
+        packet_rate = total_packets / time_span if time_span > 0 else 0
+        avg_rssi = group['rssi'].mean()
+
+        group_sorted = group.sort_values('timestamp')
+        intervals = []
+        for i in range(1, len(group_sorted)):
+            interval = (group_sorted.iloc[i]['timestamp'] - group_sorted.iloc[i-1]['timestamp']).total_seconds()
+            intervals.append(interval)
+
+        avg_interval = np.mean(intervals) if intervals else 0
+        std_interval = np.std(intervals) if intervals else 0
+
+        device_stats.append({
+            'manufacturer_data': device,
+            'device_name': group['device_name'].iloc[0] if 'device_name' in group.columns else 'Unknown',
+            'total_packets': total_packets,
+            'time_span_seconds': time_span,
+            'packet_rate_pps': packet_rate,
+            'avg_rssi': avg_rssi,
+            'avg_interval_seconds': avg_interval,
+            'std_interval_seconds': std_interval,
+            'first_seen': group['timestamp'].min(),
+            'last_seen': group['timestamp'].max()
+        })
+
+    return pd.DataFrame(device_stats)
+
+
+def make_packets(n_rows, n_devices=None, seed=0):
+    """Random packets from n_devices tracers, shuffled so groups are not pre-sorted"""
+    rng = np.random.default_rng(seed)
+    n_devices = n_devices or max(1, n_rows // 500)
+    ids = np.array([f"{i:04X}" for i in rng.choice(65536, size=n_devices, replace=False)])
+    device = rng.integers(0, n_devices, size=n_rows)
+    # Roughly one packet per 10 s per device with jitter, plus a few single-packet devices
+    millis = 1_753_000_000_000 + rng.integers(0, 10_000 * 500, size=n_rows)
+    rssi = rng.integers(-90, -30, size=n_rows).astype(float)
+    rssi[rng.random(n_rows) < 0.01] = np.nan
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(millis, unit='ms'),
+        'rssi': rssi,
+        'device_name': np.where(rng.random(n_rows) < 0.5, 'BLE Contact Tracer', 'Unknown'),
+        'manufacturer_data': ids[device],
+    })
+    singles = pd.DataFrame({'timestamp': df['timestamp'].iloc[:3], 'rssi': [-50.0, -60.0, np.nan],
+                            'device_name': 'Unknown', 'manufacturer_data': ['S001', 'S002', 'S003']})
+    return pd.concat([df, singles], ignore_index=True)
+
+
+def check_equal(expected, actual):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual.reset_index(drop=True),
+                                  check_dtype=False, rtol=1e-9, atol=1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--loop-max-rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    # Regression check on a frame small enough for the loop
+    small = make_packets(20_000, n_devices=300, seed=1)
+    check_equal(calculate_packet_delivery_metrics_loop(small), calculate_packet_delivery_metrics(small))
+    print("Vectorized output matches the original loop")
+
+    for n_rows in args.sizes:
+        df = make_packets(n_rows)
+        start = time.perf_counter()
+        vectorized = calculate_packet_delivery_metrics(df)
+        vectorized_time = time.perf_counter() - start
+        line = f"{n_rows:>10,} rows: vectorized {vectorized_time:8.3f} s"
+        if n_rows <= args.loop_max_rows:
+            start = time.perf_counter()
+            expected = calculate_packet_delivery_metrics_loop(df)
+            loop_time = time.perf_counter() - start
+            check_equal(expected, vectorized)
+            line += f", loop {loop_time:8.3f} s ({loop_time / vectorized_time:,.0f}x speedup)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares rows/sec of the original track_contacts parsing (decode, splitlines,
+header concatenation, csv.DictReader) against upload_parser's streaming path
+and the binary record format, plain and gzip-compressed.
+
+    python bench_upload_parser.py --rows 200000
+"""
+import argparse
+import csv
+import gzip
+import io
+import random
+import time
+
+from upload_parser import (UPLOAD_FIELDS, BINARY_CONTENT_TYPE, encode_binary_upload, parse_upload,
+                           parse_upload_stream, parse_upload_text)
+
+
+def make_upload(n_rows, with_header=False, seed=0):
+    """Builds an upload body in the firmware's CSV format"""
+    rng = random.Random(seed)
+    lines = [','.join(UPLOAD_FIELDS)] if with_header else []
+    t = 1753000000
+    for i in range(n_rows):
+        t += rng.randint(0, 2)
+        mac = ':'.join(f"{rng.randrange(256):02x}" for _ in range(6))
+        lines.append(f"{t},{mac},{rng.randint(-90, -30)},BLE Contact Tracer,"
+                     f"{rng.randrange(65536):04X},{rng.randrange(65536):04X}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def legacy_parse(post_data):
+    """The parsing steps track_contacts and do_POST performed before the streaming parser"""
+    csv_data = post_data.decode('utf-8')
+    expected_headers = ['timestamp', 'device_address', 'rssi', 'device_name', 'manufacturer_data', 'sender_id']
+    lines = csv_data.splitlines()
+    if lines and not any(line.startswith('timestamp') for line in lines):
+        csv_data_with_headers = ','.join(expected_headers) + '\n' + csv_data
+    else:
+        csv_data_with_headers = csv_data
+    rows = []
+    for row in csv.DictReader(csv_data_with_headers.splitlines()):
+        rows.append((
+            row.get('timestamp', 'Unknown').strip(),
+            row.get('rssi', 'Unknown').strip(),
+            row.get('device_name', 'Unknown').strip(),
+            row.get('manufacturer_data', '').strip(),
+            row.get('sender_id', 'Unknown').strip(),
+        ))
+    return rows
+
+
+def time_it(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    body = make_upload(args.rows)
+    binary = encode_binary_upload(parse_upload_text(body.decode('utf-8')))
+    binary_gzip = gzip.compress(binary)
+    print(f"Upload: {args.rows} rows, CSV {len(body) / 1e6:.1f} MB, binary {len(binary) / 1e6:.1f} MB, "
+          f"binary+gzip {len(binary_gzip) / 1e6:.1f} MB")
+
+    cases = [
+        ("legacy DictReader", lambda: legacy_parse(body)),
+        ("streaming, header sniffing", lambda: parse_upload_stream(io.BytesIO(body), len(body))),
+        ("streaming, declared schema", lambda: parse_upload_stream(io.BytesIO(body), len(body), schema=UPLOAD_FIELDS)),
+        ("binary records", lambda: parse_upload(io.BytesIO(binary), len(binary), BINARY_CONTENT_TYPE)),
+        ("binary records, gzip", lambda: parse_upload(io.BytesIO(binary_gzip), len(binary_gzip),
+                                                      BINARY_CONTENT_TYPE, 'gzip')),
+    ]
+    baseline = None
+    for name, fn in cases:
+        elapsed, rows = time_it(fn, args.repeat)
+        assert len(rows) == args.rows, (name, len(rows))
+        rate = args.rows / elapsed
+        baseline = baseline or rate
+        print(f"{name:<30} {rate:>12,.0f} rows/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
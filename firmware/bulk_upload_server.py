@@ -1,15 +1,57 @@
 import http.server
 import socketserver
+import argparse
+import queue
+import threading
+import signal
+import sys
 import os
 import csv
+import json
+import time
 from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+from contact_sink import BufferedCSVSink, FSYNC_NEVER, FSYNC_POLICIES, PROCESSED_HEADERS, processed_row
+from upload_parser import (UPLOAD_FIELDS, CONTENT_ENCODINGS, MAX_UPLOAD_ROWS, MAX_UPLOAD_BYTES, UploadTooLarge,
+                           parse_schema, parse_upload, parse_upload_text)
+from upload_partitions import (PartitionedUploadWriter, open_file_limit, UPLOAD_WINDOW_SECONDS, UPLOAD_MAX_BYTES,
+                               UPLOAD_MAX_OPEN_FILES)
+from contact_state import ContactStore, EXPOSURE_THRESHOLD_MINUTES
+from contact_journal import ContactJournal
+from event_time import EventTimeReorderer, REORDER_WINDOW_SECONDS, MAX_LATENESS_SECONDS
+from contact_shards import ShardedContactTracker
+from columnar_store import RollingParquetWriter, raw_upload_columns, processed_contact_columns
+from ingest_metrics import IngestMetrics, ExposureView
+from contact_graph import ContactGraph
+from rssi_calibration import (ProximityFilter, load_calibration, CALIBRATION_FILE, MAX_CONTACT_DISTANCE,
+                              SMOOTHING_ALPHA)
+from upload_dedup import UploadDeduplicator, body_hasher, DEDUP_MODES, DEDUP_MAX_DEVICES, DEDUP_TTL_SECONDS
+from ingest_log import (get_logger, setup_logging, stop_logging, parse_sample_rates,
+                        LOG_FORMATS, DEFAULT_RATE_LIMIT)
 
 PORT = 8081
 UPLOAD_DIR = "uploads"
 PROCESSED_DATA_FILE = "detected_contacts.csv"
+STATE_DIR = "state"         # contact state snapshot and journal, see contact_journal.py
+COLUMNAR_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "columnar")
+COLUMNAR_PROCESSED_DIR = "detected_contacts_columnar"
+STORAGE_FORMATS = ('csv', 'parquet', 'both')
+
+log = get_logger("ingest")
+contact_log = get_logger("contacts")
+http_log = get_logger("http")
+
+# Concurrency limits for the threaded ingestion server
+MAX_WORKERS = 32            # connections served at once, extra ones wait in the listen backlog
+KEEPALIVE_TIMEOUT = 15      # seconds an idle keep-alive connection may hold a worker
+MAX_PENDING_UPLOADS = 1024  # uploads queued for contact tracking before handlers block
 
-# Generating filename for raw data based on timestamp
-filename = datetime.now().strftime("upload_%Y%m%d_%H%M%S.csv")
+MAX_TRACE_HOPS = 4          # deepest exposure chain GET /trace will follow
+
+# Batching for rows written to PROCESSED_DATA_FILE
+SINK_FLUSH_ROWS = 500
+SINK_FLUSH_INTERVAL = 1.0   # seconds
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -18,201 +60,640 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 if not os.path.exists(PROCESSED_DATA_FILE):
     with open(PROCESSED_DATA_FILE, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(['server_timestamp','device_timestamp', 'delay', 'sender_id', 'rssi', 'manufacturer_data', 'device_name', 'total_contact_minutes', 'status', 'alert_triggered'])
+        writer.writerow(PROCESSED_HEADERS)
 
-# Initialize processed data file with headers if it doesn't exist
-UPLOAD_FILE = UPLOAD_DIR+"/"+filename
-if not os.path.exists(UPLOAD_FILE):
-    with open(UPLOAD_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp','device_address','rssi','device_name','manufacturer_data','sender_id'])
+# Long-lived batched writer for processed rows, opened by open_processed_sink().
+# Without one, save_contact_data falls back to appending each row directly.
+processed_sink = None
+
+# Parquet writers opened with --storage parquet/both, see columnar_store.py
+raw_columnar = None
+processed_columnar = None
+write_csv = True
+
+# Raw uploads, one CSV per device (X-Device-ID) and hour under UPLOAD_DIR, see upload_partitions.py
+raw_uploads = PartitionedUploadWriter(UPLOAD_DIR, UPLOAD_FIELDS)
+
+# Each device's last accepted upload, so the rows it resends after a lost acknowledgement
+# are only acknowledged, not stored or tracked again (--dedup off disables it)
+upload_dedup = UploadDeduplicator()
+dedup_mode = 'rows'
+
+# Per-upload caps (--max-upload-rows, --max-upload-mb), bigger uploads are refused with 413
+max_upload_rows = MAX_UPLOAD_ROWS
+max_upload_bytes = MAX_UPLOAD_BYTES
+
+# Counters and the active-contact view served by GET /metrics and GET /exposures
+ingest_metrics = IngestMetrics()
+exposure_view = ExposureView()
+
+# In-memory contact tracking, keyed by manufacturer_data
+contact_tracker = ContactStore(exposure_threshold=EXPOSURE_THRESHOLD_MINUTES)
+
+# Set by --shards: worker processes that own the contact state instead of contact_tracker
+contact_shards = None
 
-# Simple in-memory contact tracking
-contact_tracker = {} 
-EXPOSURE_THRESHOLD_MINUTES = 5
+# Set by --contact-graph: indexed contact sessions for GET /trace, see contact_graph.py
+contact_graph = None
 
-def track_contacts(csv_data):
+# Set by --proximity: drops sightings whose smoothed RSSI puts them beyond --max-distance,
+# using the path loss model fitted for that environment, see rssi_calibration.py
+proximity_filter = None
+
+# Set by --event-time: reorders sightings by device timestamp before tracking, see event_time.py
+event_time_buffer = None
+
+def track_contacts(rows, current_time=None):
     """
     Simple contact tracking function - tracks cumulative contact time,
-    logs when devices reach 5+ minutes of exposure, and saves processed data
+    logs when devices reach 5+ minutes of exposure, and saves processed data.
+    rows are ContactRow records from upload_parser, or raw CSV text which is parsed here.
+    current_time is the upload's arrival time and defaults to now. In event-time
+    mode contact durations come from the device timestamps instead.
     """
-    print(f"[+] track_contacts started")
+    log.debug("track_contacts_started")
+    cpu_started = time.thread_time()
+    late_before = event_time_buffer.late_rows if event_time_buffer is not None else 0
+    skewed_before = event_time_buffer.skewed_rows if event_time_buffer is not None else 0
+    far_rows = 0
+    delays = []
     try:
-        current_time = datetime.now()
-    
-        # Handle CSV data without headers by adding them
-        expected_headers = ['timestamp', 'device_address', 'rssi', 'device_name', 'manufacturer_data', 'sender_id']
-        
-        # Add headers if they don't exist
-        lines = csv_data.splitlines()
-        if lines and not any(line.startswith('timestamp') for line in lines):
-            csv_data_with_headers = ','.join(expected_headers) + '\n' + csv_data
-            print(f"[DEBUG] Added headers to CSV data")
-        else:
-            csv_data_with_headers = csv_data
-            
-        csv_reader = csv.DictReader(csv_data_with_headers.splitlines())
-        
-        for row in csv_reader:
-            manufacturer_data = row.get('manufacturer_data', '').strip()
-            device_name = row.get('device_name', 'Unknown').strip()
-            sender_id = row.get('sender_id', 'Unknown').strip()
-            rssi = row.get('rssi', 'Unknown').strip()
+        if current_time is None:
+            current_time = datetime.now()
+        if isinstance(rows, str):
+            rows = parse_upload_text(rows)
+        if contact_shards is not None and event_time_buffer is not None:
+            # Contacts are restored and expire in the shards; keep the lateness bookkeeping in step
+            # here, on the tracking thread
+            event_time_buffer.seed(contact_shards.pop_recovered())
+            for manufacturer_data in contact_shards.pop_expired():
+                event_time_buffer.forget(manufacturer_data)
+        if proximity_filter is not None:
+            rows, far_rows = proximity_filter.filter_rows(rows)
+        now = current_time.timestamp()
+        device_timestamp = current_time
+        event_time = now
+        delay = 0
+        sightings = [] if contact_shards is not None else None
+
+        for row in rows:
+            manufacturer_data = row.manufacturer_data
+            device_name = row.device_name
+            sender_id = row.sender_id
+            rssi = row.rssi
             
-            device_epoch_time = row.get('timestamp', 'Unknown').strip()
+            device_epoch_time = row.timestamp
             try:
-                device_timestamp = datetime.fromtimestamp(int(device_epoch_time))
-                delay = (current_time - device_timestamp).total_seconds()
+                event_time = int(device_epoch_time)
+                # The shards turn event times into datetimes themselves, when writing their rows
+                device_timestamp = datetime.fromtimestamp(event_time) if sightings is None else None
+                delay = now - event_time
             except (ValueError, TypeError) as e:
-                print(f"Error: parsing timestamp '{device_epoch_time}': {e}")
+                log.warning("bad_timestamp value=%r error=%s", device_epoch_time, e)
                 # Use current time as fallback
+                event_time = now
                 device_timestamp = current_time
                 delay = 0
+            delays.append((sender_id, delay))
             
             if not manufacturer_data or manufacturer_data == 'None':
                 continue
+
+            if event_time_buffer is not None:
+                if not event_time_buffer.add(manufacturer_data, event_time, (device_timestamp, delay, device_name, sender_id, rssi), now):
+                    contact_log.debug("late_row_dropped manufacturer_data=%s event_time=%d delay=%.0f",
+                                      manufacturer_data, event_time, delay)
+                continue
                 
-            # Track this contact
-            if manufacturer_data not in contact_tracker:
-                # New contact
-                contact_tracker[manufacturer_data] = {
-                    'first_seen': current_time,
-                    'last_seen': current_time,
-                    'total_minutes': 0,
-                    'device_name': device_name,
-                    'sender_id': sender_id,
-                    'rssi': rssi,
-                    'alerted': False
-                }
-                print(f"New contact: {manufacturer_data} ({device_name})")
-                
-                # Save new contact to processed data file
-                save_contact_data(current_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name, 0, 'new_contact', False)
-                
+            if sightings is not None:
+                sightings.append((now, event_time, delay, manufacturer_data, device_name, sender_id, rssi))
             else:
-                # Check if this is a new contact session (gap > 2 minutes)
-                contact = contact_tracker[manufacturer_data]
-                time_since_last = (current_time - contact['last_seen']).total_seconds() / 60
-                
-                if time_since_last > 2:
-                    # Gap is too large, treat as new contact session
-                    print(f"New contact session: {manufacturer_data} ({device_name}) - gap was {time_since_last:.1f} minutes")
-                    
-                    # Save the old contact session ending
-                    save_contact_data(current_time, device_timestamp, delay, contact['sender_id'], contact['rssi'], manufacturer_data, contact['device_name'], contact['total_minutes'], 'contact_ended', contact['alerted'])
-                    
-                    # Create new contact session
-                    contact_tracker[manufacturer_data] = {
-                        'first_seen': current_time,
-                        'last_seen': current_time,
-                        'total_minutes': 0,
-                        'device_name': device_name,
-                        'sender_id': sender_id,
-                        'rssi': rssi,
-                        'alerted': False
-                    }
-                    
-                    # Save new contact session
-                    save_contact_data(current_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name, 0, 'new_contact', False)
-                else:
-                    # Continue existing contact session
-                    contact['total_minutes'] += time_since_last
-                    contact['last_seen'] = current_time
-                    contact['device_name'] = device_name
-                    contact['sender_id'] = sender_id
-                    contact['rssi'] = rssi
-                
-                # Check for exposure alert
-                if contact['total_minutes'] >= EXPOSURE_THRESHOLD_MINUTES and not contact['alerted']:
-                    print(f"EXPOSURE ALERT: {manufacturer_data} ({device_name}) - {contact['total_minutes']:.2f} minutes of contact!")
-                    contact['alerted'] = True
-                    
-                    # Save exposure alert to processed data file
-                    save_contact_data(current_time, device_timestamp, delay, contact['sender_id'], contact['rssi'], manufacturer_data, device_name, contact['total_minutes'], 'exposure_detected', True)
+                apply_sighting(current_time, now, device_timestamp, delay, manufacturer_data, device_name, sender_id, rssi)
+
+        if event_time_buffer is not None:
+            for released_time, manufacturer_data, sighting in event_time_buffer.drain():
+                if sightings is not None:
+                    sightings.append((released_time, released_time, sighting[1], manufacturer_data, *sighting[2:]))
                 else:
-                    save_contact_data(current_time, device_timestamp, delay, contact['sender_id'], contact['rssi'], manufacturer_data, device_name, contact['total_minutes'], 'contact_update', contact['alerted'])
-        
-        # Clean up old contacts (remove if not seen for 10 minutes)
-        to_remove = []
-        for mfg_data, contact in contact_tracker.items():
-            minutes_since_last = (current_time - contact['last_seen']).total_seconds() / 60
-            if minutes_since_last > 10:
-                to_remove.append(mfg_data)
-        
-        for mfg_data in to_remove:
-            contact = contact_tracker[mfg_data]
-            print(f"[+] Removing old contact: {mfg_data}")
-            
-            # Save contact removal to processed data file
-            save_contact_data(current_time, device_timestamp, delay, contact['sender_id'], contact['rssi'], mfg_data, contact['device_name'], contact['total_minutes'], 'contact_ended', contact['alerted'])
-            
-            del contact_tracker[mfg_data]
+                    apply_sighting(current_time, released_time, *sighting[:2], manufacturer_data, *sighting[2:])
+            # Contacts expire on the event-time clock
+            now = event_time_buffer.watermark()
+
+        if sightings is not None:
+            # The shards track, expire and write contacts; what the views need comes back through apply_shard_output
+            contact_shards.submit(current_time, sightings, now, event_time, delay)
+        elif now is not None:
+            # Clean up old contacts (remove if not seen for 10 minutes)
+            expire_contacts(current_time, now, device_timestamp, delay)
             
     except Exception as e:
-        print(f"Error: tracking contacts: {e}")
+        log.exception("track_contacts_failed error=%s", e)
+    finally:
+        ingest_metrics.record_delays(delays)
+        late_rows = skewed_rows = 0
+        if event_time_buffer is not None:
+            late_rows = event_time_buffer.late_rows - late_before
+            skewed_rows = event_time_buffer.skewed_rows - skewed_before
+        ingest_metrics.record_tracking(time.thread_time() - cpu_started, late_rows, far_rows, skewed_rows)
+
+def apply_sighting(current_time, now, device_timestamp, delay, manufacturer_data, device_name, sender_id, rssi):
+    """Tracks one sighting at epoch time now and saves each resulting state change"""
+    for status, contact_sender, contact_rssi, contact_name, total_minutes, alerted in \
+            contact_tracker.observe(manufacturer_data, now, device_name, sender_id, rssi):
+        save_contact_data(current_time, device_timestamp, delay, contact_sender, contact_rssi, manufacturer_data, contact_name, total_minutes, status, alerted)
+
+def expire_contacts(current_time, now, device_timestamp, delay):
+    """Ends contacts not seen for 10 minutes as of epoch time now, then commits the journal"""
+    for contact in contact_tracker.expire(now):
+        contact_log.debug("contact_expired manufacturer_data=%s", contact.manufacturer_data)
+        if event_time_buffer is not None:
+            event_time_buffer.forget(contact.manufacturer_data)
+        
+        # Save contact removal to processed data file
+        save_contact_data(current_time, device_timestamp, delay, contact.sender_id, contact.rssi, contact.manufacturer_data, contact.device_name, contact.total_minutes, 'contact_ended', contact.alerted)
+
+    if contact_tracker.journal is not None:
+        contact_tracker.journal.commit(contact_tracker)
+
+def flush_event_time_buffer():
+    """Applies every sighting still held for reordering, e.g. before shutdown"""
+    if event_time_buffer is None:
+        return
+    current_time = datetime.now()
+    released = event_time_buffer.flush()
+    if contact_shards is not None:
+        sightings = [(event_time, event_time, sighting[1], manufacturer_data, *sighting[2:])
+                     for event_time, manufacturer_data, sighting in released]
+        contact_shards.submit(current_time, sightings, None, current_time.timestamp(), 0)
+        return
+    for event_time, manufacturer_data, sighting in released:
+        apply_sighting(current_time, event_time, *sighting[:2], manufacturer_data, *sighting[2:])
+    if contact_tracker.journal is not None:
+        contact_tracker.journal.commit(contact_tracker)
 
 def save_contact_data(current_time, device_timestamp, delay, sender_id,rssi, manufacturer_data, device_name, total_minutes, status, alert_triggered):
     """Save processed contact data to separate CSV file"""
+    server_time = current_time.strftime('%Y-%m-%d %H:%M:%S')
+    ingest_metrics.record_event(status)
+    exposure_view.update(manufacturer_data, sender_id, rssi, device_name, total_minutes, status, alert_triggered, server_time)
+    if contact_graph is not None:
+        contact_graph.record(device_timestamp, sender_id, manufacturer_data, rssi, total_minutes, status)
+    if processed_columnar is not None:
+        try:
+            processed_columnar.write_row((current_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name, total_minutes, status, alert_triggered))
+        except Exception as e:
+            log.error("save_failed path=%s error=%s", PROCESSED_DATA_FILE, e)
+        if not write_csv:
+            return
+    row = processed_row(server_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name,
+                        total_minutes, status, alert_triggered)
     try:
-        with open(PROCESSED_DATA_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                current_time.strftime('%Y-%m-%d %H:%M:%S'),
-                device_timestamp,
-                delay,
-                sender_id,
-                rssi,
-                manufacturer_data,
-                device_name,
-                round(total_minutes, 2),
-                status,
-                alert_triggered,
-            ])
+        if processed_sink is not None:
+            processed_sink.write_row(row)
+        else:
+            with open(PROCESSED_DATA_FILE, 'a', newline='') as f:
+                csv.writer(f).writerow(row)
     except Exception as e:
-        print(f"[!] Error saving processed data: {e}")
+        log.error("save_failed path=%s error=%s", PROCESSED_DATA_FILE, e)
+
+def apply_shard_output(current_time, events, latest, rows):
+    """Updates the metrics, exposure view and contact graph from a batch a contact shard has written"""
+    ingest_metrics.record_events(events)
+    exposure_view.update_many(latest, current_time.strftime('%Y-%m-%d %H:%M:%S'))
+    if contact_graph is not None and rows is not None:
+        for event_time, sender_id, manufacturer_data, rssi, total_minutes, status in rows:
+            contact_graph.record(event_time, sender_id, manufacturer_data, rssi, total_minutes, status)
+
+def open_processed_sink(fsync=FSYNC_NEVER, flush_rows=SINK_FLUSH_ROWS, flush_interval=SINK_FLUSH_INTERVAL):
+    """Routes save_contact_data through a batched writer until close_processed_sink() is called"""
+    global processed_sink
+    processed_sink = BufferedCSVSink(PROCESSED_DATA_FILE, header=PROCESSED_HEADERS,
+                                     flush_rows=flush_rows, flush_interval=flush_interval, fsync=fsync)
+    return processed_sink
+
+def close_processed_sink():
+    global processed_sink
+    if processed_sink is not None:
+        sink, processed_sink = processed_sink, None
+        sink.close()
+
+class ContactTrackingStage:
+    """
+    Applies track_contacts to accepted uploads on a single background thread.
+    Uploads are processed strictly in the order they were submitted, so contact
+    state stays consistent per device even when handler threads overlap.
+    """
+    def __init__(self, max_pending=MAX_PENDING_UPLOADS):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="contact-tracker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, rows, received_at):
+        # Blocks the handler when the queue is full so a backlog can't grow without bound
+        self._queue.put((rows, received_at))
+
+    def stop(self):
+        """Processes everything already queued, then stops the worker thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            rows, received_at = item
+            track_contacts(rows, received_at)
+            log.debug("track_contacts_done")
+
+
+class BoundedThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    HTTP server that serves each connection on its own thread, with at most
+    max_workers connections in flight. Further connections wait in the listen backlog.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS, tracking_stage=None):
+        self._worker_slots = threading.BoundedSemaphore(max_workers)
+        self.tracking_stage = tracking_stage
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self._worker_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._worker_slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._worker_slots.release()
+
 
 class BLEUploadHandler(http.server.SimpleHTTPRequestHandler):
     """
     Custom HTTP request handler to process POST requests for file uploads.
+    Speaks HTTP/1.1 so devices can reuse one connection for several uploads.
     """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body are separate writes; with Nagle on, the body waits for the
+    # client's delayed ACK of the headers and every keep-alive upload stalls ~40 ms
+    disable_nagle_algorithm = True
+
+    def send_text(self, code, message):
+        """Sends a short plain-text response with a Content-Length so keep-alive works"""
+        body = message.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_trace(self, query):
+        """GET /trace?id=5ECB&days=14&hops=2&min_minutes=5&min_rssi=-75: the exposure chain from one tracer"""
+        if contact_graph is None:
+            self.send_text(404, "Contact tracing is off, start the server with --contact-graph")
+            return
+        tracer_id = query.get('id', [''])[0].strip().upper()
+        if not tracer_id:
+            self.send_text(400, "id is required")
+            return
+        try:
+            end = float(query['end'][0]) if 'end' in query else time.time()
+            start = float(query['start'][0]) if 'start' in query else end - float(query.get('days', ['14'])[0]) * 86400
+            hops = min(int(query.get('hops', ['2'])[0]), MAX_TRACE_HOPS)
+            min_minutes = float(query.get('min_minutes', ['0'])[0])
+            min_rssi = int(query['min_rssi'][0]) if 'min_rssi' in query else None
+        except ValueError:
+            self.send_text(400, "start, end, days, hops, min_minutes and min_rssi must be numbers")
+            return
+        self.send_json({
+            'id': tracer_id,
+            'start': datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+            'end': datetime.fromtimestamp(end).strftime('%Y-%m-%d %H:%M:%S'),
+            'contacts': contact_graph.trace(tracer_id, start, end, hops, min_minutes, min_rssi),
+        })
+
+    def log_message(self, format, *args):
+        # The access log goes through the rate-limited 'http' category instead of stderr
+        http_log.debug("%s " + format, self.address_string(), *args)
+
+    def log_error(self, format, *args):
+        http_log.warning("%s " + format, self.address_string(), *args)
+
+    def send_json(self, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Read-only ingestion metrics, exposure and tracing queries; other paths are served as files as before"""
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            metrics = ingest_metrics.snapshot()
+            metrics['active_contacts'] = len(exposure_view)
+            metrics['dedup_devices'] = len(upload_dedup)
+            self.send_json(metrics)
+        elif url.path == '/exposures':
+            query = parse_qs(url.query)
+            try:
+                min_minutes = float(query.get('min_minutes', ['0'])[0])
+                limit = int(query.get('limit', ['0'])[0]) or None
+            except ValueError:
+                self.send_text(400, "min_minutes and limit must be numbers")
+                return
+            alerted_only = query.get('alerted', ['0'])[0] in ('1', 'true')
+            self.send_json(exposure_view.exposures(min_minutes, alerted_only, limit))
+        elif url.path == '/delays':
+            # Upload delay distribution per tracer, by its own ID (the rows' sender_id)
+            device = parse_qs(url.query).get('device', [None])[0]
+            self.send_json(ingest_metrics.device_delays(device.strip().upper() if device else None))
+        elif url.path == '/trace':
+            self.send_trace(parse_qs(url.query))
+        else:
+            super().do_GET()
+
     def do_POST(self):
+        started = time.perf_counter()
+        received_at = datetime.now()
         content_length = int(self.headers.get('Content-Length', 0))
-        print(f"[+] Received {content_length} bytes")
+        log.debug("upload_started bytes=%d client=%s", content_length, self.client_address[0])
         if content_length == 0:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"No data received")
+            ingest_metrics.record_rejected()
+            self.send_text(400, "No data received")
+            return
+        if content_length > max_upload_bytes:
+            ingest_metrics.record_rejected()
+            log.warning("upload_rejected reason=size bytes=%d client=%s", content_length, self.client_address[0])
+            # The body is not read, so the connection can't carry another request
+            self.close_connection = True
+            self.send_text(413, f"Upload larger than {max_upload_bytes} bytes")
             return
 
-        # Read the POST data from the request
-        post_data = self.rfile.read(content_length)
-        csv_data = post_data.decode('utf-8')
-        # Generate filename based on timestamp
-        filepath = os.path.join(UPLOAD_DIR, filename)
+        content_encoding = self.headers.get('Content-Encoding', 'identity').strip().lower()
+        if content_encoding not in CONTENT_ENCODINGS:
+            ingest_metrics.record_rejected()
+            self.close_connection = True
+            self.send_text(415, f"Unsupported Content-Encoding, expected one of {', '.join(CONTENT_ENCODINGS)}")
+            return
 
-        # Save raw upload
-        with open(filepath, "ab") as f:
-            f.write(post_data)
+        device_id = self.headers.get('X-Device-ID')
+        # The body is hashed as it is parsed, for recognising resends without holding it
+        hasher = body_hasher() if dedup_mode == 'rows' else None
 
-        print(f"[+] Received {len(post_data)} bytes, saved to {filepath}")
-        
-        # Process contacts for tracking and save processed data separately
-        track_contacts(csv_data)
-        
-        print(f"[+] track contacts done")
-        print(f"[+] Processed data saved to {PROCESSED_DATA_FILE}")
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"Data received and saved.")
+        # CSV bodies are parsed incrementally and devices that send X-Schema skip header
+        # detection; application/x-ble-contacts bodies use the binary record format
+        try:
+            rows = parse_upload(self.rfile, content_length, self.headers.get_content_type(), content_encoding,
+                                schema=parse_schema(self.headers.get('X-Schema')), max_rows=max_upload_rows,
+                                on_chunk=hasher.update if hasher is not None else None)
+        except UploadTooLarge as e:
+            log.warning("upload_rejected reason=size client=%s error=%s", self.client_address[0], e)
+            ingest_metrics.record_rejected()
+            self.close_connection = True
+            self.send_text(413, str(e))
+            return
+        except ValueError as e:
+            # Includes UnicodeDecodeError
+            reason = 'utf8' if isinstance(e, UnicodeDecodeError) else 'format'
+            log.warning("upload_rejected reason=%s client=%s error=%s", reason, self.client_address[0], e)
+            ingest_metrics.record_rejected()
+            self.close_connection = True
+            if reason == 'utf8':
+                self.send_text(400, "Upload is not valid UTF-8")
+            else:
+                self.send_text(400, f"Upload could not be parsed: {e}")
+            return
+
+        claim = None
+        if hasher is not None:
+            digest = hasher.digest()
+            if upload_dedup.is_resend(device_id, digest):
+                # The same bytes again: acknowledge them so the device clears its log, without storing them
+                log.debug("upload_duplicate bytes=%d device_id=%s", content_length, device_id)
+                ingest_metrics.record_duplicate(content_length, rows=len(rows))
+                self.send_text(200, "Duplicate upload, already received.")
+                return
+            parsed_rows = len(rows)
+            rows, claim = upload_dedup.claim(device_id, digest, rows)
+            if len(rows) < parsed_rows:
+                log.debug("upload_resent_rows rows=%d new_rows=%d device_id=%s", parsed_rows, len(rows), device_id)
+                ingest_metrics.record_duplicate(content_length if not rows else 0, rows=parsed_rows - len(rows))
+            if not rows and parsed_rows:
+                self.send_text(200, "Duplicate upload, already received.")
+                return
+
+        stored = False
+        try:
+            # Save raw upload, normalised to UPLOAD_FIELDS so every file has one schema
+            filepath = None
+            if write_csv:
+                filepath = raw_uploads.write_rows(device_id, rows, received_at)
+            if raw_columnar is not None:
+                raw_columnar.write_rows(rows, device_id)
+                if not write_csv:
+                    filepath = raw_columnar.directory
+
+            log.debug("upload_saved bytes=%d rows=%d path=%s", content_length, len(rows), filepath)
+
+            # Process contacts for tracking and save processed data separately
+            tracking_stage = getattr(self.server, 'tracking_stage', None)
+            if tracking_stage is not None:
+                tracking_stage.submit(rows, received_at)
+            else:
+                track_contacts(rows, received_at)
+                log.debug("track_contacts_done")
+            stored = True
+        finally:
+            if not stored and claim is not None:
+                # Forget the rows so the device's retry stores them
+                upload_dedup.release(claim)
+        self.send_text(200, "Data received and saved.")
+        ingest_metrics.record_upload(content_length, len(rows), time.perf_counter() - started)
+
+class SerialUploadHandler(BLEUploadHandler):
+    """
+    BLEUploadHandler for --serial: one connection per request as in HTTP/1.0, so an idle
+    keep-alive device can't hold the single-threaded server for KEEPALIVE_TIMEOUT
+    """
+    protocol_version = "HTTP/1.0"
+    timeout = None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BLE contact tracer upload server")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="maximum number of connections served concurrently")
+    parser.add_argument('--serial', action='store_true',
+                        help="handle one upload at a time on a single thread (original behaviour)")
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default=FSYNC_NEVER,
+                        help="'flush' fsyncs every batch written to the processed data file")
+    parser.add_argument('--flush-rows', type=int, default=SINK_FLUSH_ROWS,
+                        help="processed rows buffered before a write")
+    parser.add_argument('--flush-interval', type=float, default=SINK_FLUSH_INTERVAL,
+                        help="seconds before buffered processed rows are written regardless of count")
+    parser.add_argument('--state-dir', default=STATE_DIR,
+                        help="directory for the contact state snapshot and journal")
+    parser.add_argument('--no-persist', action='store_true',
+                        help="keep contact state in memory only, starting empty on every run")
+    parser.add_argument('--journal-fsync', action='store_true',
+                        help="fsync the contact journal after every upload")
+    parser.add_argument('--event-time', action='store_true',
+                        help="accumulate contact time from device timestamps instead of upload arrival time")
+    parser.add_argument('--reorder-window', type=int, default=REORDER_WINDOW_SECONDS,
+                        help="seconds of out-of-order device timestamps tolerated in --event-time mode")
+    parser.add_argument('--max-lateness', type=int, default=MAX_LATENESS_SECONDS,
+                        help="in --event-time mode, drop rows whose device timestamp is more than this many seconds "
+                             "before arrival, or more than --reorder-window after it (a skewed device clock). "
+                             "0 disables the check, e.g. for accelerated load generator runs")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="track contacts in this many worker processes, partitioned by manufacturer_data")
+    parser.add_argument('--storage', choices=STORAGE_FORMATS, default='csv',
+                        help="write raw uploads and processed rows as CSV, Parquet (needs pyarrow) or both")
+    parser.add_argument('--upload-window', type=int, default=UPLOAD_WINDOW_SECONDS,
+                        help="seconds covered by each per-device raw upload file")
+    parser.add_argument('--upload-max-mb', type=float, default=UPLOAD_MAX_BYTES / (1024 * 1024),
+                        help="size at which a raw upload file is rotated within its window")
+    parser.add_argument('--upload-open-files', type=int, default=UPLOAD_MAX_OPEN_FILES,
+                        help="raw upload files kept open at once, about one per tracer; least recently used are "
+                             "closed, and the descriptor limit is raised to fit where possible")
+    parser.add_argument('--max-upload-rows', type=int, default=MAX_UPLOAD_ROWS,
+                        help="rows accepted in one upload, larger ones get 413 (0 for no cap)")
+    parser.add_argument('--max-upload-mb', type=float, default=MAX_UPLOAD_BYTES / (1024 * 1024),
+                        help="request body size accepted, larger ones get 413 without being read")
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default='rows',
+                        help="'rows' drops the rows a device resends from its last accepted upload "
+                             "(by X-Device-ID), 'off' stores every upload")
+    parser.add_argument('--dedup-ttl', type=float, default=DEDUP_TTL_SECONDS,
+                        help="seconds a device's last upload is remembered")
+    parser.add_argument('--dedup-size', type=int, default=DEDUP_MAX_DEVICES,
+                        help="devices whose last upload is remembered at most, least recently seen are dropped first")
+    parser.add_argument('--contact-graph', action='store_true',
+                        help="index contact sessions for GET /trace, loading history from the processed data file")
+    parser.add_argument('--proximity', metavar='ENVIRONMENT',
+                        help="only track sightings within --max-distance, judged by the RSSI path loss model "
+                             "fitted for this environment of the calibration file ('all' pools every environment)")
+    parser.add_argument('--max-distance', type=float, default=MAX_CONTACT_DISTANCE,
+                        help="metres counted as a contact with --proximity")
+    parser.add_argument('--rssi-smoothing', type=float, default=SMOOTHING_ALPHA,
+                        help="weight of the newest RSSI sample in each contact's moving average, 1 for no smoothing")
+    parser.add_argument('--calibration-file', default=CALIBRATION_FILE,
+                        help="distance,rssi,environment readings the --proximity models are fitted to")
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        type=str.upper, help="DEBUG also logs every upload, contact change and HTTP request")
+    parser.add_argument('--log-format', choices=LOG_FORMATS, default='text')
+    parser.add_argument('--log-rate-limit', type=int, default=DEFAULT_RATE_LIMIT,
+                        help="records per second per log category below WARNING, 0 for no limit")
+    parser.add_argument('--log-sample', action='append', metavar='CATEGORY=RATE',
+                        help="keep only this fraction of a category's records below WARNING, e.g. contacts=0.1")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    # Setup and start HTTP server
+    args = parse_args()
     handler = BLEUploadHandler
-    # Start the server
-    with socketserver.TCPServer(("", PORT), handler) as httpd:
-        print(f"[*] BLE Contact Tracker started on port {PORT}")
-        print(f"[*] Exposure threshold: {EXPOSURE_THRESHOLD_MINUTES} minutes")
-        print(f"[*] Raw uploads saved to: {UPLOAD_DIR}/")
-        print(f"[*] Processed data saved to: {PROCESSED_DATA_FILE}")
-        print(f"[*] Waiting for uploads...")
-        httpd.serve_forever()
+    if args.proximity:
+        models = load_calibration(args.calibration_file)
+        if args.proximity not in models:
+            sys.exit(f"Unknown --proximity environment {args.proximity!r}, the calibration file has: "
+                     + ", ".join(sorted(models)))
+        proximity_filter = ProximityFilter(models[args.proximity], args.max_distance, args.rssi_smoothing)
+    log_config = dict(level=args.log_level, fmt=args.log_format, rate_limit=args.log_rate_limit,
+                      sample_rates=parse_sample_rates(args.log_sample))
+    # Shard processes are forked before any other threads start, including the log writer
+    if args.shards > 0:
+        # Each shard writes its own rows: all append to PROCESSED_DATA_FILE, Parquet goes to one file series per shard
+        sink_config = dict(csv_path=PROCESSED_DATA_FILE if args.storage != 'parquet' else None,
+                           flush_rows=args.flush_rows, flush_interval=args.flush_interval, fsync=args.fsync,
+                           columnar_dir=COLUMNAR_PROCESSED_DIR if args.storage != 'csv' else None)
+        contact_shards = ShardedContactTracker(args.shards, apply_shard_output, EXPOSURE_THRESHOLD_MINUTES,
+                                               state_dir=None if args.no_persist else args.state_dir,
+                                               log_config=log_config, journal_fsync=args.journal_fsync,
+                                               on_recovered=exposure_view.restore, report_keys=args.event_time,
+                                               sink_config=sink_config, report_rows=args.contact_graph)
+    log_listener = setup_logging(**log_config)
+    if contact_shards is None:
+        open_processed_sink(args.fsync, args.flush_rows, args.flush_interval)
+    dedup_mode = args.dedup
+    max_upload_rows = args.max_upload_rows
+    max_upload_bytes = int(args.max_upload_mb * 1024 * 1024)
+    upload_dedup = UploadDeduplicator(args.dedup_size, args.dedup_ttl)
+    upload_open_files = open_file_limit(args.upload_open_files)
+    if upload_open_files < args.upload_open_files:
+        log.warning("upload_open_files_reduced requested=%d allowed=%d", args.upload_open_files, upload_open_files)
+    raw_uploads = PartitionedUploadWriter(UPLOAD_DIR, UPLOAD_FIELDS, window_seconds=args.upload_window,
+                                          max_bytes=int(args.upload_max_mb * 1024 * 1024),
+                                          max_open=upload_open_files)
+    if args.storage != 'csv':
+        raw_columnar = RollingParquetWriter(COLUMNAR_UPLOAD_DIR, 'upload', raw_upload_columns())
+        if contact_shards is None:
+            processed_columnar = RollingParquetWriter(COLUMNAR_PROCESSED_DIR, 'contacts', processed_contact_columns())
+        write_csv = args.storage == 'both'
+    if proximity_filter is not None:
+        model = proximity_filter.model
+        log.info("proximity_filter environment=%s rssi_at_1m=%.1f exponent=%.2f max_distance=%.1f rssi_threshold=%.1f",
+                 model.environment, model.rssi_at_ref, model.exponent, args.max_distance, proximity_filter.threshold)
+    if args.event_time:
+        event_time_buffer = EventTimeReorderer(args.reorder_window, args.max_lateness)
+    journal = None
+    if not args.no_persist and contact_shards is None:
+        journal = ContactJournal(args.state_dir, fsync=args.journal_fsync)
+        journal.recover(contact_tracker)
+        exposure_view.restore(contact_tracker.records())
+        if event_time_buffer is not None:
+            event_time_buffer.seed((contact.manufacturer_data, contact.last_seen)
+                                   for contact in contact_tracker.records())
+    if args.contact_graph:
+        contact_graph = ContactGraph()
+        if os.path.exists(PROCESSED_DATA_FILE):
+            started = time.perf_counter()
+            rows = contact_graph.load_csv(PROCESSED_DATA_FILE)
+            log.info("contact_graph_loaded rows=%d sessions=%d ids=%d seconds=%.1f", rows, len(contact_graph),
+                     contact_graph.node_count, time.perf_counter() - started)
+    # Turn SIGTERM into a normal exit so buffered rows are flushed below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if args.serial:
+        handler = SerialUploadHandler
+        httpd = socketserver.TCPServer(("", args.port), handler)
+        tracking_stage = None
+    else:
+        tracking_stage = ContactTrackingStage()
+        tracking_stage.start()
+        httpd = BoundedThreadingHTTPServer(("", args.port), handler,
+                                           max_workers=args.workers, tracking_stage=tracking_stage)
+
+    with httpd:
+        log.info("server_started port=%d workers=%s shards=%d event_time=%s storage=%s",
+                 args.port, args.workers if tracking_stage is not None else 'serial', args.shards,
+                 f"{args.reorder_window}s" if event_time_buffer is not None else 'off', args.storage)
+        log.info("exposure_threshold_minutes=%s upload_dir=%s/ processed_file=%s",
+                 EXPOSURE_THRESHOLD_MINUTES, UPLOAD_DIR, PROCESSED_DATA_FILE)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            log.info("server_stopping")
+        finally:
+            if tracking_stage is not None:
+                tracking_stage.stop()
+            flush_event_time_buffer()
+            if contact_shards is not None:
+                contact_shards.close()
+            if journal is not None:
+                journal.close(contact_tracker)
+            close_processed_sink()
+            raw_uploads.close()
+            for writer in (raw_columnar, processed_columnar):
+                if writer is not None:
+                    writer.close()
+            stop_logging(log_listener)
@@ -0,0 +1,208 @@
+import glob
+import os
+import threading
+import time
+from datetime import datetime
+
+from ingest_log import get_logger
+
+log = get_logger("storage")
+
+# pyarrow is optional, it is only needed for --storage parquet/both
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ROW_GROUP_SIZE = 50000
+ROLL_ROWS = 5000000
+ROLL_SECONDS = 300          # a crash loses at most this much, an unfinished file has no footer
+ROLL_CHECK_SECONDS = 5
+TMP_SUFFIX = '.tmp'
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet storage needs pyarrow, install it with: pip install pyarrow")
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int8_or_none(value):
+    value = _int_or_none(value)
+    if value is None:
+        return None
+    return max(-128, min(127, value))
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+def _datetime_or_none(value):
+    return value if isinstance(value, datetime) else None
+
+
+def raw_upload_columns():
+    """(name, arrow type, converter) for raw upload rows, in ContactRow order plus the uploading device"""
+    require_pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return [
+        ('timestamp', pa.int64(), _int_or_none),
+        ('device_address', dictionary, _str),
+        ('rssi', pa.int8(), _int8_or_none),
+        ('device_name', dictionary, _str),
+        ('manufacturer_data', dictionary, _str),
+        ('sender_id', dictionary, _str),
+        ('device_id', dictionary, _str),
+    ]
+
+
+def processed_contact_columns():
+    """(name, arrow type, converter) for the rows save_contact_data writes"""
+    require_pyarrow()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return [
+        ('server_timestamp', pa.timestamp('s'), _datetime_or_none),
+        ('device_timestamp', pa.timestamp('s'), _datetime_or_none),
+        ('delay', pa.float32(), float),
+        ('sender_id', dictionary, _str),
+        ('rssi', pa.int8(), _int8_or_none),
+        ('manufacturer_data', dictionary, _str),
+        ('device_name', dictionary, _str),
+        ('total_contact_minutes', pa.float32(), float),
+        ('status', dictionary, _str),
+        ('alert_triggered', pa.bool_(), bool),
+    ]
+
+
+class RollingParquetWriter:
+    """
+    Appends rows to compressed Parquet files in directory, buffering them
+    column-wise and writing one row group per row_group_size rows.
+
+    Parquet writes its footer last, so a file is written under a .tmp name and
+    renamed to <prefix>_YYYYmmdd_HHMMSS.parquet when it is complete: once it
+    holds roll_rows rows, when a background thread finds its first row is
+    roll_seconds old, or on close(). Readers globbing *.parquet only see
+    complete files, and a crash loses at most roll_seconds of rows.
+    """
+    def __init__(self, directory, prefix, columns, row_group_size=ROW_GROUP_SIZE,
+                 roll_rows=ROLL_ROWS, roll_seconds=ROLL_SECONDS, compression='zstd',
+                 check_interval=ROLL_CHECK_SECONDS):
+        require_pyarrow()
+        self.directory = directory
+        self.prefix = prefix
+        self.row_group_size = row_group_size
+        self.roll_rows = roll_rows
+        self.roll_seconds = roll_seconds
+        self.compression = compression
+        self.schema = pa.schema([(name, arrow_type) for name, arrow_type, _ in columns])
+        self._converters = [converter for _, _, converter in columns]
+        os.makedirs(directory, exist_ok=True)
+
+        for unfinished in glob.glob(os.path.join(directory, f"{prefix}_*.parquet{TMP_SUFFIX}")):
+            log.warning("parquet_file_unfinished path=%s reason=no_footer", unfinished)
+
+        self._columns = [[] for _ in columns]
+        self._buffered = 0
+        self._first_buffered = None
+        self._writer = None
+        self._path = None
+        self._file_rows = 0
+        self._file_opened = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._roller = threading.Thread(target=self._roll_periodically, args=(check_interval,),
+                                        name=f"parquet-roll-{prefix}", daemon=True)
+        self._roller.start()
+
+    def write_row(self, row):
+        with self._lock:
+            if not self._buffered and self._writer is None:
+                self._first_buffered = time.monotonic()
+            for column, converter, value in zip(self._columns, self._converters, row):
+                column.append(converter(value))
+            self._buffered += 1
+            if self._buffered >= self.row_group_size:
+                self._write_group()
+
+    def write_rows(self, rows, *extra):
+        """Writes several rows, appending the same extra values (e.g. the device id) to each"""
+        with self._lock:
+            if rows and not self._buffered and self._writer is None:
+                self._first_buffered = time.monotonic()
+            for row in rows:
+                for column, converter, value in zip(self._columns, self._converters, (*row, *extra)):
+                    column.append(converter(value))
+                self._buffered += 1
+                if self._buffered >= self.row_group_size:
+                    self._write_group()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._roller.join()
+        with self._lock:
+            self._write_group()
+            self._close_file()
+
+    def _roll_periodically(self, check_interval):
+        while not self._closed.wait(check_interval):
+            try:
+                with self._lock:
+                    started = self._file_opened if self._writer is not None else self._first_buffered
+                    if started is not None and time.monotonic() - started >= self.roll_seconds:
+                        self._write_group()
+                        self._close_file()
+            except Exception as e:
+                log.error("parquet_roll_failed prefix=%s error=%s", self.prefix, e)
+
+    def _write_group(self):
+        if not self._buffered:
+            return
+        if self._writer is None:
+            self._open_file()
+
+        arrays = []
+        for column, field in zip(self._columns, self.schema):
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(column, type=field.type.value_type).dictionary_encode())
+            else:
+                arrays.append(pa.array(column, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._file_rows += self._buffered
+        self._columns = [[] for _ in self._columns]
+        self._buffered = 0
+        self._first_buffered = None
+        if self._file_rows >= self.roll_rows:
+            self._close_file()
+
+    def _open_file(self):
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.directory, f"{self.prefix}_{stamp}.parquet")
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + TMP_SUFFIX):
+            path = os.path.join(self.directory, f"{self.prefix}_{stamp}_{suffix}.parquet")
+            suffix += 1
+        self._writer = pq.ParquetWriter(path + TMP_SUFFIX, self.schema, compression=self.compression)
+        self._path = path
+        self._file_rows = 0
+        # The file's data starts with the oldest row buffered for it
+        self._file_opened = self._first_buffered if self._first_buffered is not None else time.monotonic()
+        log.info("parquet_file_opened prefix=%s path=%s", self.prefix, path + TMP_SUFFIX)
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._path + TMP_SUFFIX, self._path)
+            log.info("parquet_file_closed prefix=%s path=%s rows=%d", self.prefix, self._path, self._file_rows)
@@ -0,0 +1,251 @@
+import bisect
+import csv
+import threading
+from array import array
+from datetime import datetime
+
+NO_RSSI = -128
+
+# Statuses that open and close a session in the rows save_contact_data writes
+SESSION_START = ('new_contact',)
+SESSION_END = ('contact_ended',)
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def _rssi(value):
+    try:
+        return max(NO_RSSI, min(127, int(value)))
+    except (TypeError, ValueError):
+        return NO_RSSI
+
+
+def _insert_sorted(times, sessions, t, session, low=0):
+    """Inserts session at time t into parallel lists kept in time order, after equal times"""
+    if not times or times[-1] <= t:
+        times.append(t)
+        sessions.append(session)
+    else:
+        position = bisect.bisect_right(times, t, low)
+        times.insert(position, t)
+        sessions.insert(position, session)
+
+
+class ContactGraph:
+    """
+    Contact sessions between tracer IDs, built incrementally from the rows
+    save_contact_data writes. A session is one contact between the observing
+    tracer (sender_id) and the observed one (manufacturer_data), from its
+    new_contact row to its contact_ended row.
+
+    Sessions are stored column-wise in arrays. Each ID keeps its sessions
+    ordered by start time and, separately, by end time, each next to a list of
+    those times, plus the longest of its sessions. The sessions overlapping a
+    window are those starting by its end, at most that ID's longest session
+    before its start, and also those ending at or after its start; both ranges
+    are found by bisecting and the shorter one is scanned. Exposure is treated
+    as symmetric, so a session is indexed under both IDs.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}          # tracer ID -> node number
+        self._names = []        # node number -> tracer ID
+        self._a = array('i')    # observer node
+        self._b = array('i')    # observed node
+        self._start = array('d')
+        self._end = array('d')
+        self._minutes = array('d')
+        self._rssi = array('b')  # strongest RSSI seen during the session
+        self._by_node = []       # node -> [session numbers in start order]
+        self._starts_by_node = []  # node -> [their start times]
+        self._by_end_node = []   # node -> [session numbers in end order]
+        self._ends_by_node = []  # node -> [their end times]
+        self._longest = []       # node -> longest session duration, seconds
+        self._open = {}          # manufacturer_data -> session number still in progress
+
+    def __len__(self):
+        return len(self._start)
+
+    @property
+    def node_count(self):
+        return len(self._names)
+
+    def _node(self, tracer_id):
+        node = self._ids.get(tracer_id)
+        if node is None:
+            node = self._ids[tracer_id] = len(self._names)
+            self._names.append(tracer_id)
+            self._by_node.append([])
+            self._starts_by_node.append([])
+            self._by_end_node.append([])
+            self._ends_by_node.append([])
+            self._longest.append(0.0)
+        return node
+
+    def record(self, event_time, sender_id, manufacturer_data, rssi, total_minutes, status):
+        """Applies one tracker row; event_time is a datetime or epoch seconds (the device timestamp)"""
+        t = _epoch(event_time)
+        if t is None or not sender_id or not manufacturer_data or sender_id == manufacturer_data:
+            return
+        with self._lock:
+            session = self._open.get(manufacturer_data)
+            if status in SESSION_END:
+                # Written when the next sighting or an expiry check notices the gap, so its
+                # time is not part of the session
+                if session is not None:
+                    self._minutes[session] = float(total_minutes)
+                    del self._open[manufacturer_data]
+                return
+            if session is None or status in SESSION_START:
+                session = self._add_session(self._node(sender_id), self._node(manufacturer_data), t)
+                self._open[manufacturer_data] = session
+            if t > self._end[session]:
+                self._extend(session, t)
+            self._minutes[session] = float(total_minutes)
+            strength = _rssi(rssi)
+            if strength > self._rssi[session]:
+                self._rssi[session] = strength
+
+    def _add_session(self, a, b, t):
+        session = len(self._start)
+        self._a.append(a)
+        self._b.append(b)
+        self._start.append(t)
+        self._end.append(t)
+        self._minutes.append(0.0)
+        self._rssi.append(NO_RSSI)
+        for node in (a, b):
+            # Rows reordered by event time can start a session before the latest one
+            _insert_sorted(self._starts_by_node[node], self._by_node[node], t, session)
+            _insert_sorted(self._ends_by_node[node], self._by_end_node[node], t, session)
+        return session
+
+    def _extend(self, session, t):
+        """Moves a session's end to t, later than its current end, in both nodes' end order"""
+        old = self._end[session]
+        self._end[session] = t
+        duration = t - self._start[session]
+        for node in (self._a[session], self._b[session]):
+            if duration > self._longest[node]:
+                self._longest[node] = duration
+            ends = self._ends_by_node[node]
+            sessions = self._by_end_node[node]
+            if sessions[-1] == session:
+                ends[-1] = t
+                continue
+            # Usually one of the node's latest sessions, so near the tail
+            position = bisect.bisect_left(ends, old)
+            while sessions[position] != session:
+                position += 1
+            del ends[position]
+            del sessions[position]
+            _insert_sorted(ends, sessions, t, session, position)
+
+    def contacts(self, tracer_id, start=None, end=None, min_minutes=0, min_rssi=None):
+        """
+        Direct contacts of tracer_id with sessions overlapping [start, end] (epoch seconds).
+        Returns {contact ID: (minutes, strongest RSSI, first overlap time)} for contacts whose
+        qualifying sessions add up to at least min_minutes.
+        """
+        with self._lock:
+            node = self._ids.get(tracer_id)
+            if node is None:
+                return {}
+            found = self._neighbours(node, start, end, min_rssi)
+        return {self._names[other]: value for other, value in found.items() if value[0] >= min_minutes}
+
+    def _neighbours(self, node, start, end, min_rssi):
+        """contacts() for a node number; the caller holds the lock"""
+        starts = self._starts_by_node[node]
+        low = 0 if start is None else bisect.bisect_left(starts, start - self._longest[node])
+        high = len(starts) if end is None else bisect.bisect_right(starts, end)
+        ends = self._ends_by_node[node]
+        low_end = 0 if start is None else bisect.bisect_left(ends, start)
+        if high - low <= len(ends) - low_end:
+            candidates = self._by_node[node][low:high]
+        else:
+            candidates = self._by_end_node[node][low_end:]
+        a, b, s_end, s_start = self._a, self._b, self._end, self._start
+        minutes, rssi = self._minutes, self._rssi
+        found = {}
+        for session in candidates:
+            if start is not None and s_end[session] < start:
+                continue
+            if end is not None and s_start[session] > end:
+                continue
+            strength = rssi[session]
+            if min_rssi is not None and strength < min_rssi:
+                continue
+            other = b[session] if a[session] == node else a[session]
+            overlap = s_start[session] if start is None else max(start, s_start[session])
+            total, best, first = found.get(other, (0.0, NO_RSSI, overlap))
+            found[other] = (total + minutes[session], max(best, strength), min(first, overlap))
+        return found
+
+    def trace(self, tracer_id, start=None, end=None, hops=2, min_minutes=0, min_rssi=None):
+        """
+        Exposure chain from tracer_id: everyone within `hops` contacts during [start, end].
+        A contact only passes exposure on from the time it was itself exposed, so a
+        second-degree contact must overlap the first-degree one after their shared session began.
+        Returns a list of dicts (id, hops, via, exposed_at, minutes, rssi), nearest first.
+        """
+        with self._lock:
+            source = self._ids.get(tracer_id)
+        if source is None:
+            return []
+        # The lock is held per node expanded, so uploads are not stalled for a whole trace
+        reached = {source: (0, None, start, 0.0, None)}
+        frontier = [source]
+        for hop in range(1, hops + 1):
+            next_frontier = []
+            for node in frontier:
+                exposed_at = reached[node][2]
+                with self._lock:
+                    found = self._neighbours(node, exposed_at, end, min_rssi)
+                for other, (minutes, strength, first) in found.items():
+                    if minutes < min_minutes:
+                        continue
+                    known = reached.get(other)
+                    if known is None:
+                        next_frontier.append(other)
+                    elif known[0] < hop or known[2] is None or known[2] <= first:
+                        continue
+                    reached[other] = (hop, node, first, minutes, strength)
+            frontier = next_frontier
+            if not frontier:
+                break
+        with self._lock:
+            names = self._names
+            result = [
+                {
+                    'id': names[node],
+                    'hops': hop,
+                    'via': names[via],
+                    'exposed_at': datetime.fromtimestamp(first).strftime('%Y-%m-%d %H:%M:%S') if first else None,
+                    'minutes': round(minutes, 2),
+                    'rssi': strength,
+                }
+                for node, (hop, via, first, minutes, strength) in reached.items() if node != source
+            ]
+        result.sort(key=lambda contact: (contact['hops'], -contact['minutes']))
+        return result
+
+    def load_csv(self, path):
+        """Replays a processed contacts CSV (the server's PROCESSED_DATA_FILE) into the graph"""
+        rows = 0
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                event_time = row.get('device_timestamp') or row.get('server_timestamp') or row.get('timestamp')
+                self.record(event_time, row.get('sender_id'), row.get('manufacturer_data'), row.get('rssi'),
+                            row.get('total_contact_minutes') or 0, row.get('status'))
+                rows += 1
+        return rows
@@ -0,0 +1,157 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from contact_state import ContactRecord
+from ingest_log import get_logger
+
+log = get_logger("storage")
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PATTERN = "journal_{:08d}.log"
+
+SNAPSHOT_EVERY_CHANGES = 50000  # journal entries written before a new snapshot is taken
+SNAPSHOT_EVERY_SECONDS = 300
+
+
+class ContactJournal:
+    """
+    Persists ContactStore state as an append-only journal of record changes plus
+    periodic compact snapshots, all kept in state_dir.
+
+    Each journal line is ["put", <ContactRecord.state()>] or ["del", manufacturer_data].
+    Taking a snapshot starts a new journal segment and copies the live records;
+    the copy is written on a background thread and the segments it covers are
+    then deleted. Recovery loads the snapshot and replays only the newer segments.
+    """
+    def __init__(self, state_dir, fsync=False, snapshot_every=SNAPSHOT_EVERY_CHANGES,
+                 snapshot_interval=SNAPSHOT_EVERY_SECONDS):
+        self.state_dir = state_dir
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(state_dir, exist_ok=True)
+
+        self._segment_id = 0
+        self._segment = None
+        self._changes = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_thread = None
+
+    def recover(self, store):
+        """Loads the last snapshot and the journal written after it into store, then attaches to it"""
+        records = {}
+        covered = 0
+        snapshot_path = os.path.join(self.state_dir, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            covered = snapshot['segment']
+            for state in snapshot['records']:
+                records[state[0]] = ContactRecord.from_state(state)
+
+        replayed = 0
+        segments = self._segments()
+        for segment_id, path in segments:
+            if segment_id <= covered:
+                continue
+            replayed += self._replay(path, records)
+
+        store.load(records.values())
+        store.journal = self
+        last_segment = segments[-1][0] if segments else 0
+        self._open_segment(max(covered, last_segment) + 1)
+        log.info("state_restored contacts=%d journal_entries=%d state_dir=%s", len(records), replayed, self.state_dir)
+        return store
+
+    def put(self, contact):
+        self._segment.write(json.dumps(['put', contact.state()]) + '\n')
+        self._changes += 1
+
+    def delete(self, manufacturer_data):
+        self._segment.write(json.dumps(['del', manufacturer_data]) + '\n')
+        self._changes += 1
+
+    def commit(self, store):
+        """Makes the journal durable up to this point; called once per processed upload"""
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        due = (self._changes >= self.snapshot_every or
+               (self._changes and time.monotonic() - self._last_snapshot >= self.snapshot_interval))
+        if due and not self._snapshot_running():
+            self.snapshot(store)
+
+    def snapshot(self, store, wait=False):
+        """Starts a new segment and writes the current records as a snapshot in the background"""
+        covered = self._segment_id
+        states = [contact.state() for contact in store.records()]
+        self._open_segment(covered + 1)
+        self._changes = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=(covered, states),
+                                                 name="contact-snapshot", daemon=True)
+        self._snapshot_thread.start()
+        if wait:
+            self._snapshot_thread.join()
+
+    def close(self, store):
+        """Writes a final snapshot so the next start has nothing to replay"""
+        if self._snapshot_running():
+            self._snapshot_thread.join()
+        self.snapshot(store, wait=True)
+        self._segment.close()
+
+    def _snapshot_running(self):
+        return self._snapshot_thread is not None and self._snapshot_thread.is_alive()
+
+    def _write_snapshot(self, covered, states):
+        snapshot_path = os.path.join(self.state_dir, SNAPSHOT_FILE)
+        tmp_path = snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'segment': covered, 'records': states}, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, snapshot_path)
+            for segment_id, path in self._segments():
+                if segment_id <= covered:
+                    os.remove(path)
+        except Exception as e:
+            log.error("snapshot_failed error=%s", e)
+
+    def _open_segment(self, segment_id):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_id = segment_id
+        path = os.path.join(self.state_dir, SEGMENT_PATTERN.format(segment_id))
+        self._segment = open(path, 'a', buffering=256 * 1024)
+
+    def _segments(self):
+        segments = []
+        for path in glob.glob(os.path.join(self.state_dir, SEGMENT_PATTERN.replace('{:08d}', '*'))):
+            name = os.path.basename(path)
+            try:
+                segments.append((int(name[len('journal_'):-len('.log')]), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    @staticmethod
+    def _replay(path, records):
+        replayed = 0
+        with open(path) as f:
+            for line in f:
+                try:
+                    op, value = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    break
+                if op == 'put':
+                    records[value[0]] = ContactRecord.from_state(value)
+                else:
+                    records.pop(value, None)
+                replayed += 1
+        return replayed
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import threading
+import zlib
+from collections import deque
+from datetime import datetime
+
+from contact_state import ContactStore, ContactRecord, EXPOSURE_THRESHOLD_MINUTES
+from contact_journal import ContactJournal
+from contact_sink import BufferedCSVSink, PROCESSED_HEADERS, FSYNC_NEVER, processed_row
+from ingest_log import get_logger, setup_logging, stop_logging
+
+log = get_logger("contacts")
+
+
+def shard_for(manufacturer_data, num_shards):
+    """Stable shard index for a contact key (hash() is salted per process, crc32 is not)"""
+    return zlib.crc32(manufacturer_data.encode('utf-8')) % num_shards
+
+
+def _open_outputs(shard_id, sink_config):
+    """This shard's processed row writers: the shared CSV file and/or its own Parquet files"""
+    csv_sink = columnar = None
+    if sink_config.get('csv_path'):
+        csv_sink = BufferedCSVSink(sink_config['csv_path'], header=PROCESSED_HEADERS,
+                                   flush_rows=sink_config.get('flush_rows', 500),
+                                   flush_interval=sink_config.get('flush_interval', 1.0),
+                                   fsync=sink_config.get('fsync', FSYNC_NEVER))
+    if sink_config.get('columnar_dir'):
+        from columnar_store import RollingParquetWriter, processed_contact_columns
+        columnar = RollingParquetWriter(sink_config['columnar_dir'], f"contacts_shard{shard_id:02d}",
+                                        processed_contact_columns())
+    return csv_sink, columnar
+
+
+def _shard_main(shard_id, inbox, outbox, exposure_threshold, state_dir, log_config, journal_fsync=False,
+                sink_config=None, report_rows=False):
+    """
+    Worker process: owns the ContactStore for one slice of manufacturer_data keys and
+    writes the rows it produces to its own sinks. The parent only gets what its in-memory
+    views need: event counts, each contact's last row per batch and, with report_rows,
+    every row's (event_time, sender_id, manufacturer_data, rssi, total_minutes, status).
+    """
+    # The parent's log writer thread does not exist after fork, so each shard runs its own
+    log_listener = setup_logging(**log_config) if log_config is not None else None
+    csv_sink, columnar = _open_outputs(shard_id, sink_config or {})
+    store = ContactStore(exposure_threshold=exposure_threshold)
+    journal = None
+    if state_dir is not None:
+        journal = ContactJournal(os.path.join(state_dir, f"shard_{shard_id:02d}"), fsync=journal_fsync)
+        journal.recover(store)
+        if len(store):
+            # Recovered contacts produce no rows until seen again, so the parent is told about them
+            outbox.put((None, None, None, None, [], [contact.state() for contact in store.records()]))
+
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        current_time, columns, expire_now, expire_event_time, expire_delay = batch
+        server_time = current_time.strftime('%Y-%m-%d %H:%M:%S')
+        events = {}
+        latest = {}
+        rows = [] if report_rows else None
+        csv_rows = [] if csv_sink is not None else None
+        expired = []
+
+        def write(event_time, delay, sender_id, rssi, manufacturer_data, device_name, total_minutes, status, alerted):
+            events[status] = events.get(status, 0) + 1
+            latest[manufacturer_data] = (sender_id, rssi, device_name, total_minutes, status, alerted)
+            if rows is not None:
+                rows.append((event_time, sender_id, manufacturer_data, rssi, total_minutes, status))
+            device_timestamp = datetime.fromtimestamp(event_time)
+            if columnar is not None:
+                try:
+                    columnar.write_row((current_time, device_timestamp, delay, sender_id, rssi, manufacturer_data,
+                                        device_name, total_minutes, status, alerted))
+                except Exception as e:
+                    log.error("save_failed shard=%d error=%s", shard_id, e)
+            if csv_rows is not None:
+                csv_rows.append(processed_row(server_time, device_timestamp, delay, sender_id, rssi,
+                                              manufacturer_data, device_name, total_minutes, status, alerted))
+
+        for now, event_time, delay, manufacturer_data, device_name, sender_id, rssi in zip(*columns):
+            for status, contact_sender, contact_rssi, contact_name, total_minutes, alerted in \
+                    store.observe(manufacturer_data, now, device_name, sender_id, rssi):
+                write(event_time, delay, contact_sender, contact_rssi, manufacturer_data, contact_name,
+                      total_minutes, status, alerted)
+        if expire_now is not None:
+            for contact in store.expire(expire_now):
+                log.debug("contact_expired manufacturer_data=%s shard=%d", contact.manufacturer_data, shard_id)
+                expired.append(contact.manufacturer_data)
+                write(expire_event_time, expire_delay, contact.sender_id, contact.rssi, contact.manufacturer_data,
+                      contact.device_name, contact.total_minutes, 'contact_ended', contact.alerted)
+        if csv_rows:
+            try:
+                csv_sink.write_rows(csv_rows)
+            except Exception as e:
+                log.error("save_failed shard=%d error=%s", shard_id, e)
+        if journal is not None:
+            journal.commit(store)
+        if events:
+            outbox.put((current_time, events, latest, rows, expired, None))
+
+    if journal is not None:
+        journal.close(store)
+    for output in (csv_sink, columnar):
+        if output is not None:
+            output.close()
+    outbox.put(None)
+    stop_logging(log_listener)
+
+
+class ShardedContactTracker:
+    """
+    Partitions contact state by manufacturer_data across worker processes.
+
+    submit() splits one upload's sightings by shard and sends each slice over
+    that shard's queue as columns; every shard also gets the expiry time so stale
+    contacts end even without new rows. Queues are FIFO and a key always maps to
+    the same shard, so per-contact order is kept. Each shard formats and writes
+    its rows to its own sinks, opened from sink_config (csv_path, flush_rows,
+    flush_interval, fsync, columnar_dir). A merger thread hands each processed
+    batch to on_output(current_time, events, latest, rows) in the parent, see
+    _shard_main, and passes the contacts each shard recovered from its journal to
+    on_recovered. With report_keys it also keeps the recovered contacts' last_seen
+    for pop_recovered() and the keys of expired contacts for pop_expired(); the
+    caller must then drain both.
+    """
+    def __init__(self, num_shards, on_output, exposure_threshold=EXPOSURE_THRESHOLD_MINUTES, state_dir=None,
+                 log_config=None, journal_fsync=False, on_recovered=None, report_keys=False, sink_config=None,
+                 report_rows=False):
+        self.num_shards = num_shards
+        self._on_output = on_output
+        self._on_recovered = on_recovered
+        self._report_keys = report_keys
+        self._expired = deque()
+        self._recovered = deque()
+        self._outbox = multiprocessing.Queue()
+        self._inboxes = []
+        self._workers = []
+        for shard_id in range(num_shards):
+            inbox = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=_shard_main, name=f"contact-shard-{shard_id}",
+                                             args=(shard_id, inbox, self._outbox, exposure_threshold, state_dir, log_config,
+                                                   journal_fsync, sink_config, report_rows),
+                                             daemon=True)
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        self._merger = threading.Thread(target=self._merge, name="contact-shard-merger", daemon=True)
+        self._merger.start()
+
+    def submit(self, current_time, sightings, expire_now, expire_event_time, delay):
+        """
+        sightings are (now, event_time, delay, manufacturer_data, device_name, sender_id, rssi)
+        tuples in processing order, event_time being the device timestamp in epoch seconds;
+        expire_now is the epoch time contacts are expired against, and rows for expired
+        contacts carry expire_event_time and delay.
+        """
+        slices = [[] for _ in range(self.num_shards)]
+        for sighting in sightings:
+            slices[shard_for(sighting[3], self.num_shards)].append(sighting)
+        for inbox, shard_sightings in zip(self._inboxes, slices):
+            if shard_sightings or expire_now is not None:
+                # Sent as seven columns, which pickle far faster than one tuple per row
+                inbox.put((current_time, list(zip(*shard_sightings)), expire_now, expire_event_time, delay))
+
+    def pop_recovered(self):
+        """(manufacturer_data, last_seen) of contacts the shards restored since the last call"""
+        recovered = []
+        while self._recovered:
+            recovered.append(self._recovered.popleft())
+        return recovered
+
+    def pop_expired(self):
+        """Keys of contacts the shards have expired since the last call"""
+        expired = []
+        while self._expired:
+            expired.append(self._expired.popleft())
+        return expired
+
+    def close(self):
+        """Lets every shard finish its queue, then waits for all output to be merged"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        self._merger.join()
+        for worker in self._workers:
+            worker.join()
+
+    def _merge(self):
+        running = self.num_shards
+        while running:
+            output = self._outbox.get()
+            if output is None:
+                running -= 1
+                continue
+            current_time, events, latest, rows, expired, recovered = output
+            if recovered:
+                records = [ContactRecord.from_state(state) for state in recovered]
+                if self._report_keys:
+                    self._recovered.extend((contact.manufacturer_data, contact.last_seen) for contact in records)
+                if self._on_recovered is not None:
+                    try:
+                        self._on_recovered(records)
+                    except Exception as e:
+                        log.error("shard_recovery_report_failed error=%s", e)
+            if events:
+                try:
+                    self._on_output(current_time, events, latest, rows)
+                except Exception as e:
+                    log.error("shard_output_failed error=%s", e)
+            if self._report_keys:
+                self._expired.extend(expired)
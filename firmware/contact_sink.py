@@ -0,0 +1,97 @@
+import csv
+import io
+import os
+import threading
+
+from ingest_log import get_logger
+
+log = get_logger("storage")
+
+# fsync policies for BufferedCSVSink
+FSYNC_NEVER = 'never'   # rows reach the OS page cache on every flush, the kernel decides when to hit disk
+FSYNC_FLUSH = 'flush'   # every flush is followed by os.fsync, so a flushed batch survives power loss
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_FLUSH)
+
+# Columns of the processed contacts file, one row per contact state change
+PROCESSED_HEADERS = ['server_timestamp', 'device_timestamp', 'delay', 'sender_id', 'rssi', 'manufacturer_data',
+                     'device_name', 'total_contact_minutes', 'status', 'alert_triggered']
+
+
+def processed_row(server_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name,
+                  total_minutes, status, alert_triggered):
+    """A PROCESSED_HEADERS row, server_time already formatted"""
+    return [server_time, device_timestamp, delay, sender_id, rssi, manufacturer_data, device_name,
+            round(total_minutes, 2), status, alert_triggered]
+
+
+class BufferedCSVSink:
+    """
+    Long-lived CSV output that keeps the file open, batches rows in memory and
+    writes them out once flush_rows rows are pending or flush_interval seconds
+    have passed. Safe to call from several threads; close() flushes what is left.
+    Each flush is one write to an O_APPEND descriptor, so sinks in several
+    processes (one per contact shard) can share a file without splitting lines.
+    """
+    def __init__(self, path, header=None, flush_rows=500, flush_interval=1.0, fsync=FSYNC_NEVER):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}")
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        write_header = header is not None and (not os.path.exists(path) or os.path.getsize(path) == 0)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._pending = [header] if write_header else []
+        if write_header:
+            self._flush_locked()
+
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="csv-sink-flush", daemon=True)
+        self._flusher.start()
+
+    def write_row(self, row):
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows:
+                self._flush_locked()
+
+    def write_rows(self, rows):
+        with self._lock:
+            self._pending.extend(rows)
+            if len(self._pending) >= self.flush_rows:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Stops the background flusher and writes out every pending row"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            self._flush_locked()
+            os.close(self._fd)
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        text = io.StringIO(newline='')
+        csv.writer(text).writerows(self._pending)
+        self._pending = []
+        data = memoryview(text.getvalue().encode('utf-8'))
+        while data:
+            data = data[os.write(self._fd, data):]
+        if self.fsync == FSYNC_FLUSH:
+            os.fsync(self._fd)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("flush_failed path=%s error=%s", self.path, e)
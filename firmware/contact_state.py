@@ -0,0 +1,149 @@
+import heapq
+
+from ingest_log import get_logger
+
+log = get_logger("contacts")
+
+EXPOSURE_THRESHOLD_MINUTES = 5
+SESSION_GAP_MINUTES = 2     # a longer gap between sightings starts a new contact session
+STALE_CONTACT_MINUTES = 10  # contacts unseen for longer are ended and dropped
+
+
+class ContactRecord:
+    """State of one contact session. Times are epoch seconds."""
+    __slots__ = ('manufacturer_data', 'first_seen', 'last_seen', 'total_minutes',
+                 'device_name', 'sender_id', 'rssi', 'alerted')
+
+    def __init__(self, manufacturer_data, now, device_name, sender_id, rssi):
+        self.manufacturer_data = manufacturer_data
+        self.first_seen = now
+        self.last_seen = now
+        self.total_minutes = 0
+        self.device_name = device_name
+        self.sender_id = sender_id
+        self.rssi = rssi
+        self.alerted = False
+
+    def state(self):
+        """Plain tuple of every field, in __slots__ order, for snapshots and the journal"""
+        return (self.manufacturer_data, self.first_seen, self.last_seen, self.total_minutes,
+                self.device_name, self.sender_id, self.rssi, self.alerted)
+
+    @classmethod
+    def from_state(cls, state):
+        contact = cls.__new__(cls)
+        (contact.manufacturer_data, contact.first_seen, contact.last_seen, contact.total_minutes,
+         contact.device_name, contact.sender_id, contact.rssi, contact.alerted) = state
+        return contact
+
+    def event(self, status, device_name=None):
+        """Row values for save_contact_data: (status, sender_id, rssi, device_name, total_minutes, alerted)"""
+        return (status, self.sender_id, self.rssi, device_name or self.device_name, self.total_minutes, self.alerted)
+
+
+class ContactStore:
+    """
+    Active contact sessions keyed by manufacturer_data, with a min-heap on
+    last_seen so stale contacts are found without scanning every record.
+    Heap entries are not removed when a contact is seen again; outdated
+    entries are skipped when popped and the heap is rebuilt once they
+    outnumber live records.
+    """
+    def __init__(self, exposure_threshold=EXPOSURE_THRESHOLD_MINUTES,
+                 session_gap=SESSION_GAP_MINUTES, stale_after=STALE_CONTACT_MINUTES):
+        self.exposure_threshold = exposure_threshold
+        self.session_gap = session_gap
+        self.stale_after = stale_after
+        self._records = {}
+        self._expiry = []  # (last_seen, manufacturer_data)
+        # Optional ContactJournal that is told about every change, see contact_journal.py
+        self.journal = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, manufacturer_data):
+        return manufacturer_data in self._records
+
+    def get(self, manufacturer_data):
+        return self._records.get(manufacturer_data)
+
+    def records(self):
+        return self._records.values()
+
+    def load(self, records):
+        """Replaces the current contents with the given ContactRecords, e.g. after recovery"""
+        self._records = {contact.manufacturer_data: contact for contact in records}
+        self._expiry = [(c.last_seen, c.manufacturer_data) for c in self._records.values()]
+        heapq.heapify(self._expiry)
+
+    def observe(self, manufacturer_data, now, device_name, sender_id, rssi):
+        """
+        Applies one sighting at epoch time now and returns the resulting events:
+        new_contact, contact_ended followed by new_contact when the gap was too
+        long, then contact_update or exposure_detected for a continuing session.
+        """
+        contact = self._records.get(manufacturer_data)
+        if contact is None:
+            contact = self._start(manufacturer_data, now, device_name, sender_id, rssi)
+            log.debug("new_contact manufacturer_data=%s device_name=%s", manufacturer_data, device_name)
+            if self.journal is not None:
+                self.journal.put(contact)
+            return [contact.event('new_contact')]
+
+        events = []
+        # A sighting older than last_seen (event-time rows reordered across a restart or a
+        # flush) adds no time and doesn't move last_seen back
+        time_since_last = max(0.0, (now - contact.last_seen) / 60)
+        if time_since_last > self.session_gap:
+            # Gap is too large, end the old session and start a new one
+            log.debug("new_contact_session manufacturer_data=%s device_name=%s gap_minutes=%.1f", manufacturer_data, device_name, time_since_last)
+            events.append(contact.event('contact_ended'))
+            contact = self._start(manufacturer_data, now, device_name, sender_id, rssi)
+            events.append(contact.event('new_contact'))
+        else:
+            contact.total_minutes += time_since_last
+            contact.device_name = device_name
+            contact.sender_id = sender_id
+            contact.rssi = rssi
+            if now > contact.last_seen:
+                contact.last_seen = now
+                self._push_expiry(contact)
+
+        if contact.total_minutes >= self.exposure_threshold and not contact.alerted:
+            # WARNING so the category limiter never samples or rate-limits an alert away
+            log.warning("exposure_alert manufacturer_data=%s device_name=%s total_minutes=%.2f", manufacturer_data, device_name, contact.total_minutes)
+            contact.alerted = True
+            events.append(contact.event('exposure_detected', device_name))
+        else:
+            events.append(contact.event('contact_update', device_name))
+        if self.journal is not None:
+            self.journal.put(contact)
+        return events
+
+    def expire(self, now):
+        """Removes and returns contacts not seen for stale_after minutes, oldest first"""
+        cutoff = now - self.stale_after * 60
+        expired = []
+        while self._expiry and self._expiry[0][0] < cutoff:
+            last_seen, manufacturer_data = heapq.heappop(self._expiry)
+            contact = self._records.get(manufacturer_data)
+            # Skip entries left behind by later sightings
+            if contact is not None and contact.last_seen == last_seen:
+                del self._records[manufacturer_data]
+                expired.append(contact)
+                if self.journal is not None:
+                    self.journal.delete(manufacturer_data)
+        return expired
+
+    def _start(self, manufacturer_data, now, device_name, sender_id, rssi):
+        contact = ContactRecord(manufacturer_data, now, device_name, sender_id, rssi)
+        self._records[manufacturer_data] = contact
+        self._push_expiry(contact)
+        return contact
+
+    def _push_expiry(self, contact):
+        heapq.heappush(self._expiry, (contact.last_seen, contact.manufacturer_data))
+        if len(self._expiry) > 4 * len(self._records) + 64:
+            self._expiry = [(c.last_seen, c.manufacturer_data) for c in self._records.values()]
+            heapq.heapify(self._expiry)
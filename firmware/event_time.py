@@ -0,0 +1,110 @@
+import heapq
+
+REORDER_WINDOW_SECONDS = 120
+MAX_LATENESS_SECONDS = 24 * 3600  # oldest device timestamp accepted, relative to the upload's arrival
+
+
+class EventTimeReorderer:
+    """
+    Buffers sightings and releases them in device-timestamp order.
+
+    The watermark is the newest event time seen from any device minus window
+    seconds. Buffered sightings at or below it are released in event-time order,
+    and it is the event-time clock used to expire contacts. A sighting older
+    than the last one already released for its key is late and gets dropped,
+    because applying it would rewind that contact's state.
+
+    Event times must lie within [arrival - max_lateness, arrival + window]. One
+    tracer with a clock running ahead would otherwise push the watermark forward
+    and expire every contact in the fleet; one that never synced its clock
+    reports times near 1970. A max_lateness of 0 turns the check off, for
+    replays that run faster than real time.
+    """
+    def __init__(self, window=REORDER_WINDOW_SECONDS, max_lateness=MAX_LATENESS_SECONDS):
+        self.window = window
+        self.max_lateness = max_lateness
+        self.late_rows = 0
+        self.skewed_rows = 0
+        self._pending = {}        # key -> heap of (event_time, seq, item)
+        self._last_released = {}  # key -> event time of the last released sighting
+        self._oldest = []         # (event_time, key) for every buffered sighting, in watermark order
+        self._seq = 0
+        self._global_max = None
+
+    def __len__(self):
+        return sum(len(heap) for heap in self._pending.values())
+
+    def add(self, key, event_time, item, arrival_time):
+        """
+        Buffers one sighting, returns False if it arrived too late to be used or its
+        event time is implausibly far from arrival_time (epoch seconds)
+        """
+        if self.max_lateness and not arrival_time - self.max_lateness <= event_time <= arrival_time + self.window:
+            self.skewed_rows += 1
+            return False
+        if event_time < self._last_released.get(key, event_time):
+            self.late_rows += 1
+            return False
+        self._seq += 1
+        heapq.heappush(self._pending.setdefault(key, []), (event_time, self._seq, item))
+        heapq.heappush(self._oldest, (event_time, key))
+        if self._global_max is None or event_time > self._global_max:
+            self._global_max = event_time
+        return True
+
+    def watermark(self):
+        """Event time up to which all devices are assumed complete, or None before any data"""
+        if self._global_max is None:
+            return None
+        return self._global_max - self.window
+
+    def drain(self):
+        """Returns (event_time, key, item) tuples at or below the watermark, oldest first"""
+        ready = []
+        watermark = self.watermark()
+        touched = set()
+        while self._oldest and self._oldest[0][0] <= watermark:
+            event_time, key = heapq.heappop(self._oldest)
+            touched.add(key)
+
+        for key in touched:
+            heap = self._pending.get(key)
+            if heap is None:
+                continue
+            while heap and heap[0][0] <= watermark:
+                event_time, seq, item = heapq.heappop(heap)
+                ready.append((event_time, seq, key, item))
+            if not heap:
+                del self._pending[key]
+        return self._release(ready)
+
+    def flush(self):
+        """Releases everything still buffered regardless of watermarks, e.g. on shutdown"""
+        ready = []
+        for key, heap in self._pending.items():
+            for event_time, seq, item in heap:
+                ready.append((event_time, seq, key, item))
+        self._pending = {}
+        self._oldest = []
+        return self._release(ready)
+
+    def _release(self, ready):
+        ready.sort()
+        for event_time, seq, key, item in ready:
+            self._last_released[key] = event_time
+        return [(event_time, key, item) for event_time, seq, key, item in ready]
+
+    def seed(self, last_seen):
+        """
+        Takes (key, event time) pairs of contacts restored from a journal as already
+        released, so sightings older than their state are dropped as late after a restart
+        """
+        released = self._last_released
+        for key, event_time in last_seen:
+            if event_time > released.get(key, event_time - 1):
+                released[key] = event_time
+
+    def forget(self, key):
+        """Drops lateness bookkeeping for a contact that has been expired"""
+        if key not in self._pending:
+            self._last_released.pop(key, None)
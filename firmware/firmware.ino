@@ -197,6 +197,7 @@ void uploadDataToServer() {
   http.addHeader("User-Agent", "ESP32-BLE-ContactTracer/1.0");
   http.addHeader("X-Device-ID", String(ESP.getEfuseMac(), HEX));
   http.addHeader("X-Data-Type", "contact-trace");
+  http.addHeader("X-Schema", "timestamp,device_address,rssi,device_name,manufacturer_data,sender_id"); // lets the server skip header detection
   http.addHeader("X-Timestamp", String(t)); // Use Unix epoch time here
   
   Serial.println("Sending " + String(csvData.length()) + " bytes of CSV data...");
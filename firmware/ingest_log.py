@@ -0,0 +1,143 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+ROOT_LOGGER = "ble"
+LOG_FORMATS = ('text', 'json')
+DEFAULT_RATE_LIMIT = 200  # records per second per category before suppression
+
+
+def get_logger(category):
+    """Logger for one category (ingest, contacts, storage, http, ...) under the 'ble' root"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+
+class KeyValueFormatter(logging.Formatter):
+    """time level category message, e.g. '2025-07-28 15:01:06 INFO contacts new_contact manufacturer_data=5ECB'"""
+    def format(self, record):
+        line = f"{self.formatTime(record, '%Y-%m-%d %H:%M:%S')} {record.levelname} {_category(record)} {record.getMessage()}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line for log collectors"""
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'category': _category(record),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _category(record):
+    return record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name
+
+
+class CategoryLimiter(logging.Filter):
+    """
+    Per-category sampling and token-bucket rate limiting, applied on the calling
+    thread before a record is queued. WARNING and above are never dropped. The
+    next record let through for a category notes how many were suppressed.
+    """
+    def __init__(self, rate_limit=DEFAULT_RATE_LIMIT, sample_rates=None):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.sample_rates = sample_rates or {}
+        self._lock = threading.Lock()
+        self._buckets = {}     # category -> [tokens, last refill]
+        self._sampled = {}     # category -> records seen, for deterministic 1-in-N sampling
+        self._suppressed = {}  # category -> records dropped since the last one let through
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        category = _category(record)
+        with self._lock:
+            if not self._allow(category):
+                self._suppressed[category] = self._suppressed.get(category, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(category, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} earlier {category} records suppressed)"
+        return True
+
+    def _allow(self, category):
+        rate = self.sample_rates.get(category)
+        if rate is not None and rate < 1:
+            seen = self._sampled.get(category, 0) + 1
+            self._sampled[category] = seen
+            if rate <= 0 or seen % round(1 / rate) != 0:
+                return False
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        bucket = self._buckets.get(category)
+        if bucket is None:
+            bucket = self._buckets[category] = [self.rate_limit, now]
+        bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+    The stock prepare() formats on the calling thread; records here stay in
+    process, so they can be queued as they are.
+    """
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level='INFO', fmt='text', rate_limit=DEFAULT_RATE_LIMIT, sample_rates=None, stream=None):
+    """
+    Routes every 'ble.*' logger through a queue to a background writer thread.
+    Returns the QueueListener; call stop_logging() with it on shutdown to drain the queue.
+    """
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{fmt}', expected one of {LOG_FORMATS}")
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == 'json' else KeyValueFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(CategoryLimiter(rate_limit, sample_rates))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    """Writes out every queued record and stops the writer thread"""
+    if listener is not None:
+        listener.stop()
+
+
+def parse_sample_rates(values):
+    """Parses ['contacts=0.1', 'http=0'] into {'contacts': 0.1, 'http': 0.0}"""
+    rates = {}
+    for value in values or []:
+        category, _, rate = value.partition('=')
+        rates[category.strip()] = float(rate)
+    return rates
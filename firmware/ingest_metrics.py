@@ -0,0 +1,230 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+
+# Upper bounds of the histogram buckets; the last bucket catches everything above
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+DELAY_BUCKETS_S = (1, 5, 10, 30, 60, 120, 300, 900, 3600, 21600, 86400)
+
+RATE_WINDOW_SECONDS = 60
+MAX_DELAY_DEVICES = 100000  # devices given their own delay histogram, later ones only count fleet-wide
+
+
+class Histogram:
+    """Fixed-bucket histogram. Not locked itself, IngestMetrics guards it."""
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class RateCounter:
+    """Per-second totals over the last window seconds, for recent throughput figures"""
+    def __init__(self, window=RATE_WINDOW_SECONDS):
+        self.window = window
+        self._slots = [0] * window
+        self._slot_second = [0] * window
+
+    def add(self, amount, now):
+        second = int(now)
+        slot = second % self.window
+        if self._slot_second[slot] != second:
+            self._slot_second[slot] = second
+            self._slots[slot] = 0
+        self._slots[slot] += amount
+
+    def rate(self, now):
+        # Only complete seconds, so the current partial second doesn't drag the rate down
+        current = int(now)
+        total = sum(amount for amount, second in zip(self._slots, self._slot_second)
+                    if current - self.window <= second < current)
+        return total / self.window
+
+
+class IngestMetrics:
+    """
+    Ingestion counters updated by the upload handlers and the tracking stage.
+    Every update is a few additions under one lock, and snapshot() only reads
+    them, so polling the metrics endpoint never waits on upload processing.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.rejected_uploads = 0
+        self.duplicate_uploads = 0
+        self.duplicate_bytes = 0
+        self.duplicate_rows = 0
+        self.rows_parsed = 0
+        self.late_rows = 0
+        self.far_rows = 0
+        self.skewed_rows = 0
+        self.events = {}
+        self.track_cpu_seconds = 0.0
+        self._request_latency = Histogram(LATENCY_BUCKETS_MS)
+        self._delay = Histogram(DELAY_BUCKETS_S)
+        self._device_delay = {}  # sender_id -> Histogram
+        self._upload_rate = RateCounter()
+        self._row_rate = RateCounter()
+
+    def record_upload(self, nbytes, rows, latency_seconds):
+        now = time.time()
+        with self._lock:
+            self.uploads += 1
+            self.upload_bytes += nbytes
+            self.rows_parsed += rows
+            self._request_latency.observe(latency_seconds * 1000)
+            self._upload_rate.add(1, now)
+            self._row_rate.add(rows, now)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected_uploads += 1
+
+    def record_duplicate(self, nbytes, rows=0):
+        """A resent upload: nbytes for one dropped entirely, rows for resent rows dropped from it"""
+        with self._lock:
+            self.duplicate_uploads += 1
+            self.duplicate_bytes += nbytes
+            self.duplicate_rows += rows
+
+    def record_delays(self, delays):
+        """(sender_id, delay in seconds) of one upload's rows, the uploading tracer's own ID"""
+        with self._lock:
+            device_delay = self._device_delay
+            for sender_id, delay in delays:
+                self._delay.observe(delay)
+                histogram = device_delay.get(sender_id)
+                if histogram is None:
+                    if len(device_delay) >= MAX_DELAY_DEVICES:
+                        continue
+                    histogram = device_delay[sender_id] = Histogram(DELAY_BUCKETS_S)
+                histogram.observe(delay)
+
+    def device_delays(self, sender_id=None):
+        """Delay histogram per uploading device, or for one device ({} if it hasn't uploaded)"""
+        with self._lock:
+            if sender_id is not None:
+                histogram = self._device_delay.get(sender_id)
+                return {sender_id: histogram.snapshot()} if histogram is not None else {}
+            return {device: histogram.snapshot() for device, histogram in self._device_delay.items()}
+
+    def record_tracking(self, cpu_seconds, late_rows=0, far_rows=0, skewed_rows=0):
+        with self._lock:
+            self.track_cpu_seconds += cpu_seconds
+            self.late_rows += late_rows
+            self.far_rows += far_rows
+            self.skewed_rows += skewed_rows
+
+    def record_event(self, status):
+        with self._lock:
+            self.events[status] = self.events.get(status, 0) + 1
+
+    def record_events(self, counts):
+        """Adds {status: rows} counted elsewhere, e.g. by a contact shard"""
+        with self._lock:
+            for status, count in counts.items():
+                self.events[status] = self.events.get(status, 0) + count
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'uptime_seconds': round(now - self._started, 1),
+                'uploads': self.uploads,
+                'upload_bytes': self.upload_bytes,
+                'rejected_uploads': self.rejected_uploads,
+                'duplicate_uploads': self.duplicate_uploads,
+                'duplicate_bytes': self.duplicate_bytes,
+                'duplicate_rows': self.duplicate_rows,
+                'rows_parsed': self.rows_parsed,
+                'late_rows_dropped': self.late_rows,
+                'far_rows_dropped': self.far_rows,
+                'clock_skew_rows_dropped': self.skewed_rows,
+                'uploads_per_second': self._upload_rate.rate(now),
+                'rows_per_second': self._row_rate.rate(now),
+                'alerts_raised': self.events.get('exposure_detected', 0),
+                'events': dict(self.events),
+                'track_contacts_cpu_seconds': round(self.track_cpu_seconds, 3),
+                'request_latency_ms': self._request_latency.snapshot(),
+                'device_delay_seconds': self._delay.snapshot(),
+                'delay_devices': len(self._device_delay),
+            }
+
+
+class ExposureView:
+    """
+    Read-only copy of the active contacts, kept current from the rows written by
+    save_contact_data. It works the same whether contacts are tracked in process
+    or in shards, and queries never touch the tracker itself.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contacts = {}
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def restore(self, records):
+        """Adds contacts recovered from a journal (ContactRecords), which produce no rows until seen again"""
+        with self._lock:
+            for contact in records:
+                self._contacts[contact.manufacturer_data] = (
+                    contact.sender_id, contact.rssi, contact.device_name, contact.total_minutes, contact.alerted,
+                    datetime.fromtimestamp(contact.last_seen).strftime('%Y-%m-%d %H:%M:%S'))
+
+    def update(self, manufacturer_data, sender_id, rssi, device_name, total_minutes, status, alerted, server_time):
+        with self._lock:
+            if status == 'contact_ended':
+                self._contacts.pop(manufacturer_data, None)
+            else:
+                self._contacts[manufacturer_data] = (sender_id, rssi, device_name, total_minutes, alerted, server_time)
+
+    def update_many(self, latest, server_time):
+        """
+        Applies {manufacturer_data: (sender_id, rssi, device_name, total_minutes, status, alerted)},
+        the last row of each contact in a batch written at server_time
+        """
+        with self._lock:
+            for manufacturer_data, (sender_id, rssi, device_name, total_minutes, status, alerted) in latest.items():
+                if status == 'contact_ended':
+                    self._contacts.pop(manufacturer_data, None)
+                else:
+                    self._contacts[manufacturer_data] = (sender_id, rssi, device_name, total_minutes, alerted,
+                                                         server_time)
+
+    def exposures(self, min_minutes=0, alerted_only=False, limit=None):
+        """Active contacts with at least min_minutes of contact, longest first"""
+        with self._lock:
+            items = list(self._contacts.items())
+        result = [
+            {
+                'manufacturer_data': manufacturer_data,
+                'sender_id': sender_id,
+                'rssi': rssi,
+                'device_name': device_name,
+                'total_contact_minutes': round(total_minutes, 2),
+                'alert_triggered': alerted,
+                'last_update': server_time,
+            }
+            for manufacturer_data, (sender_id, rssi, device_name, total_minutes, alerted, server_time) in items
+            if total_minutes >= min_minutes and (alerted or not alerted_only)
+        ]
+        result.sort(key=lambda contact: contact['total_contact_minutes'], reverse=True)
+        return result[:limit] if limit else result
@@ -0,0 +1,367 @@
+"""
+Load generator and replay harness for bulk_upload_server.py.
+
+Simulates N tracers posting uploads with the firmware's headers, as CSV or
+binary records (--format) and optionally compressed, or replays captured
+upload files. Reports throughput, client latency percentiles and the
+server's track_contacts CPU time (from GET /metrics).
+
+    python load_generator.py --speedup 10 simulate --devices 200 --duration 60
+    python load_generator.py --speedup 0 replay ../uploads
+
+simulate: every device scans for --upload-interval simulated seconds and then
+posts one row per sighting of each of --contacts nearby devices. --speedup
+compresses simulated time (0 sends as fast as the server answers).
+replay: rows are grouped into uploads per device (the uploads/<device>/
+directory, or the file for older flat uploads) and per --upload-interval of
+their own timestamps, then sent in timestamp order at --speedup.
+"""
+import argparse
+import glob
+import gzip
+import heapq
+import http.client
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import zlib
+
+from upload_parser import (UPLOAD_FIELDS, BINARY_CONTENT_TYPE, CONTENT_ENCODINGS, encode_binary_upload,
+                           parse_upload_text)
+
+UPLOAD_INTERVAL_SECONDS = 30   # firmware: 10 s idle plus a 20 s scan before each upload
+SIGHTINGS_PER_SCAN = 4         # rows logged per nearby device during one scan
+SCHEMA_HEADER = ','.join(UPLOAD_FIELDS)
+UPLOAD_FORMATS = ('csv', 'binary')
+
+
+class SimulatedDevice:
+    """One tracer: its advertised manufacturer_data and the devices it keeps seeing"""
+    def __init__(self, index, rng):
+        self.device_id = f"{rng.getrandbits(48):x}"
+        self.address = ':'.join(f"{rng.randrange(256):02x}" for _ in range(6))
+        self.manufacturer_data = f"{index:04X}"
+        self.rng = rng
+        self.neighbours = []
+
+    def upload(self, scan_end, interval, sightings):
+        """Rows logged during one scan ending at epoch second scan_end, as the firmware's CSV fields"""
+        rows = []
+        for neighbour in self.neighbours:
+            for _ in range(sightings):
+                t = scan_end - self.rng.randrange(interval)
+                # sender_id is the observing tracer's own advertised ID, as in firmware.ino
+                rows.append((str(t), neighbour.address, str(self.rng.randint(-90, -40)), 'BLE Contact Tracer',
+                             neighbour.manufacturer_data, self.manufacturer_data))
+        rows.sort()
+        return rows
+
+
+def simulated_schedule(num_devices, contacts, duration, interval, speedup, sightings, seed, start=None):
+    """Yields (due seconds from start, device_id, rows, device timestamp) in due order"""
+    rng = random.Random(seed)
+    devices = [SimulatedDevice(i, random.Random(rng.random())) for i in range(num_devices)]
+    for device in devices:
+        others = [other for other in devices if other is not device]
+        device.neighbours = rng.sample(others, min(contacts, len(others)))
+
+    start = int(time.time()) if start is None else start
+    rounds = max(1, int(duration * speedup / interval)) if speedup else max(1, int(duration))
+    # Devices are spread across the interval, as real tracers are not in step
+    offsets = [rng.random() * interval for _ in devices]
+    for round_index in range(rounds):
+        batch = []
+        for device, offset in zip(devices, offsets):
+            simulated = round_index * interval + offset
+            scan_end = start + int(simulated)
+            due = simulated / speedup if speedup else 0
+            batch.append((due, device.device_id, device.upload(scan_end, interval, sightings), scan_end))
+        batch.sort(key=lambda item: item[0])
+        yield from batch
+
+
+def replay_files(paths):
+    """(path, device_id) for upload files and directories; a file's device is its partition directory"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.splitext(os.path.basename(path))[0]))
+            continue
+        for file_path in sorted(glob.glob(os.path.join(path, '**', 'upload_*.csv'), recursive=True)):
+            relative = os.path.relpath(os.path.dirname(file_path), path)
+            # Flat files from before per-device partitioning each stand in for one device
+            device_id = relative if relative != '.' else os.path.splitext(os.path.basename(file_path))[0]
+            files.append((file_path, device_id))
+    return files
+
+
+def replay_schedule(files, interval, speedup):
+    """Groups captured rows into per-device uploads and yields them like simulated_schedule"""
+    uploads = []
+    for path, device_id in files:
+        with open(path, encoding='utf-8') as f:
+            rows = parse_upload_text(f.read())
+        windows = {}
+        for row in rows:
+            try:
+                t = int(row.timestamp)
+            except ValueError:
+                continue
+            windows.setdefault(t // interval, []).append(row)
+        for window, window_rows in windows.items():
+            uploads.append(((window + 1) * interval, device_id, window_rows))
+    if not uploads:
+        return
+    uploads.sort(key=lambda item: item[0])
+    first = uploads[0][0]
+    for device_time, device_id, rows in uploads:
+        yield ((device_time - first) / speedup if speedup else 0), device_id, rows, device_time
+
+
+def encode_upload(rows, fmt='csv', content_encoding='identity'):
+    """Request body and Content-Type for one upload"""
+    if fmt == 'binary':
+        body, content_type = encode_binary_upload(rows), BINARY_CONTENT_TYPE
+    else:
+        body, content_type = ''.join(','.join(row) + '\n' for row in rows).encode('utf-8'), 'text/csv'
+    if content_encoding == 'gzip':
+        body = gzip.compress(body)
+    elif content_encoding == 'deflate':
+        body = zlib.compress(body)
+    return body, content_type
+
+
+def post_upload(connection, device_id, body, device_time, content_type='text/csv', content_encoding='identity'):
+    headers = {
+        'Content-Type': content_type,
+        'User-Agent': 'ESP32-BLE-ContactTracer/1.0',
+        'X-Device-ID': device_id,
+        'X-Data-Type': 'contact-trace',
+        'X-Schema': SCHEMA_HEADER,
+        'X-Timestamp': str(device_time),
+    }
+    if content_encoding != 'identity':
+        headers['Content-Encoding'] = content_encoding
+    connection.request('POST', '/', body, headers)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def fetch_metrics(host, port):
+    try:
+        connection = http.client.HTTPConnection(host, port, timeout=10)
+        connection.request('GET', '/metrics')
+        response = connection.getresponse()
+        payload = response.read()
+        connection.close()
+        return json.loads(payload) if response.status == 200 else None
+    except (OSError, ValueError):
+        return None
+
+
+class LoadRun:
+    """
+    Sends a schedule of uploads over `connections` keep-alive connections.
+    Every device is pinned to one connection so its uploads stay in order, as
+    they would from the real tracer. Uploads are sent when due; a connection
+    that falls behind sends immediately and the lag is reported. Bodies are
+    encoded up front so encoding time is not counted. For a `resend` fraction of
+    uploads the acknowledgement counts as lost: like the firmware, which keeps its
+    log until a POST gets a response, the device's next upload repeats those rows
+    ahead of its new ones, under its own X-Timestamp.
+    """
+    def __init__(self, host, port, connections, fmt='csv', content_encoding='identity', resend=0.0):
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.fmt = fmt
+        self.content_encoding = content_encoding
+        self.resend = resend
+        self.resent = 0
+        self.resent_rows = 0
+        self.latencies = []
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, schedule):
+        queues = [[] for _ in range(self.connections)]
+        assignment = {}
+        unacknowledged = {}  # device_id -> rows of its last upload, when that one counts as lost
+        rng = random.Random(0)
+        for sequence, (due, device_id, rows, device_time) in enumerate(schedule):
+            if not rows:
+                continue
+            resent = unacknowledged.pop(device_id, [])
+            self.resent_rows += len(resent)
+            rows = resent + list(rows)
+            body, content_type = encode_upload(rows, self.fmt, self.content_encoding)
+            slot = assignment.setdefault(device_id, len(assignment) % self.connections)
+            heapq.heappush(queues[slot], (due, sequence, device_id, body, len(rows), content_type, device_time))
+            if rng.random() < self.resend:
+                unacknowledged[device_id] = rows
+                self.resent += 1
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._send, args=(uploads, started), daemon=True)
+                   for uploads in queues if uploads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def _send(self, uploads, started):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        latencies, rows, nbytes, errors, max_lag = [], 0, 0, 0, 0.0
+        while uploads:
+            due, _, device_id, body, body_rows, content_type, device_time = heapq.heappop(uploads)
+            wait = started + due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                max_lag = max(max_lag, -wait)
+            sent = time.perf_counter()
+            try:
+                status = post_upload(connection, device_id, body, device_time, content_type, self.content_encoding)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - sent)
+            if status != 200:
+                errors += 1
+            rows += body_rows
+            nbytes += len(body)
+        connection.close()
+        with self._lock:
+            self.latencies.extend(latencies)
+            self.rows += rows
+            self.bytes += nbytes
+            self.errors += errors
+            self.max_lag = max(self.max_lag, max_lag)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(run, elapsed, before, after, paced=True):
+    latencies = sorted(run.latencies)
+    report = {
+        'uploads': len(latencies),
+        'rows': run.rows,
+        'resent': run.resent,
+        'resent_rows': run.resent_rows,
+        'errors': run.errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'uploads_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'rows_per_second': round(run.rows / elapsed, 1) if elapsed else 0,
+        'megabytes_per_second': round(run.bytes / elapsed / 1e6, 3) if elapsed else 0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0,
+            'mean': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0,
+        },
+    }
+    if paced:
+        report['max_schedule_lag_seconds'] = round(run.max_lag, 3)
+    if before is not None and after is not None:
+        cpu = after['track_contacts_cpu_seconds'] - before['track_contacts_cpu_seconds']
+        server_rows = after['rows_parsed'] - before['rows_parsed']
+        report['server'] = {
+            'rows_parsed': server_rows,
+            'track_contacts_cpu_seconds': round(cpu, 3),
+            'track_contacts_us_per_row': round(cpu / server_rows * 1e6, 2) if server_rows else 0,
+            'active_contacts': after.get('active_contacts'),
+            'alerts_raised': after['alerts_raised'] - before['alerts_raised'],
+            'duplicate_uploads': after.get('duplicate_uploads', 0) - before.get('duplicate_uploads', 0),
+            'duplicate_rows': after.get('duplicate_rows', 0) - before.get('duplicate_rows', 0),
+        }
+    return report
+
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"Uploads:     {report['uploads']:,} ({report['errors']} errors) in {report['elapsed_seconds']:.1f} s")
+    print(f"Throughput:  {report['uploads_per_second']:,.1f} uploads/s, {report['rows_per_second']:,.0f} rows/s, "
+          f"{report['megabytes_per_second']:.2f} MB/s")
+    print(f"Latency:     p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms")
+    if report.get('max_schedule_lag_seconds', 0) > 0.5:
+        print(f"Behind:      up to {report['max_schedule_lag_seconds']:.1f} s late, the server could not keep up")
+    server = report.get('server')
+    if server is None:
+        print("Server:      GET /metrics unavailable, no server-side figures")
+        return
+    print(f"Server:      {server['rows_parsed']:,} rows parsed, track_contacts {server['track_contacts_cpu_seconds']:.2f} s CPU "
+          f"({server['track_contacts_us_per_row']:.1f} us/row), {server['alerts_raised']} alerts")
+    print("             track_contacts runs asynchronously, so rows still queued at the end are not counted")
+    if report['resent']:
+        print(f"Resent:      {report['resent_rows']:,} rows of {report['resent']:,} unacknowledged uploads, "
+              f"{server['duplicate_rows']:,} dropped as duplicates")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--connections', type=int, default=16,
+                        help="concurrent keep-alive connections, each serving a fixed set of devices")
+    parser.add_argument('--upload-interval', type=int, default=UPLOAD_INTERVAL_SECONDS,
+                        help="simulated seconds between a device's uploads")
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help="simulated seconds per real second, 0 sends as fast as the server answers")
+    parser.add_argument('--format', choices=UPLOAD_FORMATS, default='csv',
+                        help="upload body format, binary is application/x-ble-contacts")
+    parser.add_argument('--content-encoding', choices=CONTENT_ENCODINGS, default='identity')
+    parser.add_argument('--resend', type=float, default=0.0,
+                        help="fraction of uploads whose rows the device sends again with its next upload, "
+                             "as after a timed-out POST")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    simulate = modes.add_parser('simulate', help="synthetic tracers")
+    simulate.add_argument('--devices', type=int, default=50)
+    simulate.add_argument('--contacts', type=int, default=5, help="nearby devices each tracer sees")
+    simulate.add_argument('--sightings', type=int, default=SIGHTINGS_PER_SCAN,
+                          help="rows per nearby device in each upload")
+    simulate.add_argument('--duration', type=float, default=30,
+                          help="real seconds to run for (upload rounds per device with --speedup 0)")
+    simulate.add_argument('--seed', type=int, default=0)
+    simulate.add_argument('--start', type=int, help="epoch second of the first scan, default now; fix it for repeatable runs")
+
+    replay = modes.add_parser('replay', help="captured upload files")
+    replay.add_argument('paths', nargs='+', help="upload CSV files or directories searched recursively")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.mode == 'simulate':
+        schedule = simulated_schedule(args.devices, args.contacts, args.duration, args.upload_interval,
+                                      args.speedup, args.sightings, args.seed, args.start)
+    else:
+        schedule = replay_schedule(replay_files(args.paths), args.upload_interval, args.speedup)
+
+    before = fetch_metrics(args.host, args.port)
+    run = LoadRun(args.host, args.port, args.connections, args.format, args.content_encoding, args.resend)
+    elapsed = run.run(schedule)
+    after = fetch_metrics(args.host, args.port)
+    report = summarize(run, elapsed, before, after, paced=args.speedup > 0)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,106 @@ import seaborn as sns
 from datetime import datetime, timedelta
 import os
 import glob
+import json
+import pickle
+import hashlib
+import time
+import shutil
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from rssi_calibration import ProximityFilter, load_calibration, pair_keys, CALIBRATION_FILE, MAX_CONTACT_DISTANCE
 
 plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
 
-def load_raw_packet_data(uploads_dir='uploads'):
-    """Aggregates all upload sessions for comprehensive packet analysis across time periods"""
-    all_data = []
-    upload_files = glob.glob(os.path.join(uploads_dir, 'upload_*.csv'))
+# Explicit column types so every upload file parses the same way; columns a file lacks are ignored
+UPLOAD_DTYPES = {
+    'timestamp': 'int64',
+    'device_address': str,
+    'rssi': 'float32',
+    'device_name': str,
+    'manufacturer_data': str,
+    'sender_id': str,
+    'service_uuid': str,
+}
+CACHE_DIR_NAME = '.cache'
+
+# stream_packet_metrics sorts by device timestamp out of core: rows are first spilled in buckets
+# of this many milliseconds, and a bucket holding more than one chunk is split this many ways
+STREAM_BUCKET_MS = 3600 * 1000
+STREAM_SPLIT = 16
+
+# Columns read from the server's Parquet uploads, and those identifying one packet across storage formats
+PACKET_COLUMNS = ['timestamp', 'device_address', 'rssi', 'device_name', 'manufacturer_data', 'sender_id']
+PACKET_KEY_COLUMNS = ['timestamp', 'device_address', 'rssi', 'manufacturer_data', 'sender_id']
+
+# Figures drawn by the --report mode: plot function, the aggregate it draws from, the columns it
+# reads and its file under the plots directory. A figure is redrawn only when those columns change
+REPORT_PLOTS = (
+    ('plot_packet_delivery_histogram', 'device_stats', ['packet_rate_pps'], 'packet_delivery_histogram.png'),
+    ('plot_rssi_vs_packet_rate', 'device_stats', ['avg_rssi', 'packet_rate_pps'], 'rssi_vs_packet_rate.png'),
+    ('plot_packet_intervals', 'device_stats', ['avg_interval_seconds'], 'packet_intervals.png'),
+    ('plot_packet_rate_over_time', 'df_hourly', ['timestamp', 'packet_rate_pps'], 'packet_rate_over_time.png'),
+)
+
+def _read_upload_file(uploads_dir, relative_path):
+    """Parses one upload file; runs in a worker process"""
+    try:
+        df = pd.read_csv(os.path.join(uploads_dir, relative_path), dtype=UPLOAD_DTYPES)
+        if 'manufacturer_data' not in df.columns:
+            # Early firmware did not log it; the packets count overall but not towards any device
+            df['manufacturer_data'] = None
+        df['source_file'] = relative_path
+        
+        # Extract upload session timestamp for temporal analysis
+        filename = os.path.basename(relative_path)
+        if filename.startswith('upload_'):
+            # upload_<YYYYmmdd_HHMMSS>[_<n>].csv, the suffix numbers files rotated within one window
+            timestamp_str = filename[7:-4][:15]
+            try:
+                df['upload_timestamp'] = pd.to_datetime(timestamp_str, format='%Y%m%d_%H%M%S')
+            except:
+                print(f"Error parsing timestamp: {timestamp_str}")
+        
+        # Convert ESP32 millisecond timestamps to datetime for analysis
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', origin='unix')
+        return relative_path, df, None
+    except Exception as e:
+        return relative_path, None, e
+
+def _file_manifest(base_dir, file_paths):
+    """{path relative to base_dir: [size, mtime_ns]}, what the caches are checked against"""
+    manifest = {}
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        manifest[os.path.relpath(file_path, base_dir)] = [stat.st_size, stat.st_mtime_ns]
+    return manifest
+
+def _load_upload_cache(cache_dir):
+    """Returns the consolidated dataset and the manifest it was built from, or (None, {})"""
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        return pd.read_pickle(os.path.join(cache_dir, 'uploads.pkl')), manifest
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None, {}
+
+def _save_upload_cache(cache_dir, combined_df, manifest):
+    os.makedirs(cache_dir, exist_ok=True)
+    combined_df.to_pickle(os.path.join(cache_dir, 'uploads.pkl.tmp'))
+    os.replace(os.path.join(cache_dir, 'uploads.pkl.tmp'), os.path.join(cache_dir, 'uploads.pkl'))
+    with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+def load_raw_packet_data(uploads_dir='uploads', workers=None, use_cache=True):
+    """
+    Aggregates all upload sessions for comprehensive packet analysis across time periods.
+    Parsed files are kept in a consolidated cache under uploads_dir/.cache keyed on each
+    file's path, size and mtime, so reruns only parse new or changed files, in parallel.
+    """
+    upload_files = sorted(glob.glob(os.path.join(uploads_dir, '**', 'upload_*.csv'), recursive=True))
     
     if not upload_files:
         print(f"No upload files found in {uploads_dir}/")
@@ -21,74 +113,427 @@ def load_raw_packet_data(uploads_dir='uploads'):
     
     print(f"Found {len(upload_files)} upload files")
     
-    for file_path in upload_files:
-        try:
-            df = pd.read_csv(file_path)
-            df['source_file'] = os.path.basename(file_path)
-            
-            # Extract upload session timestamp for temporal analysis
-            filename = os.path.basename(file_path)
-            if filename.startswith('upload_'):
-                timestamp_str = filename[7:-4]
-                try:
-                    df['upload_timestamp'] = pd.to_datetime(timestamp_str, format='%Y%m%d_%H%M%S')
-                except:
-                    print(f"Error parsing timestamp: {timestamp_str}")
-                
-            all_data.append(df)
-            print(f"Loaded {len(df)} packets from {os.path.basename(file_path)}")
-        except Exception as e:
-            print(f"Error loading {file_path}: {e}")
+    manifest = _file_manifest(uploads_dir, upload_files)
+    cache_dir = os.path.join(uploads_dir, CACHE_DIR_NAME)
+    cached_df, cached_manifest = _load_upload_cache(cache_dir) if use_cache else (None, {})
+    unchanged = [path for path, key in manifest.items() if cached_manifest.get(path) == key]
+    to_parse = [path for path in manifest if cached_manifest.get(path) != manifest[path]]
+    
+    if cached_df is not None and not to_parse and len(unchanged) == len(cached_manifest):
+        print(f"Loaded {len(cached_df)} packets from cache ({cache_dir}/)")
+        print(f"Total packets loaded: {len(cached_df)}")
+        return cached_df
+    
+    all_data = []
+    if cached_df is not None and unchanged:
+        all_data.append(cached_df[cached_df['source_file'].isin(unchanged)])
+        print(f"Loaded {len(all_data[0])} cached packets from {len(unchanged)} unchanged files")
+    
+    if len(to_parse) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_read_upload_file, [uploads_dir] * len(to_parse), to_parse))
+    else:
+        results = [_read_upload_file(uploads_dir, path) for path in to_parse]
+    
+    loaded = dict((path, manifest[path]) for path in unchanged)
+    for relative_path, df, error in results:
+        if error is not None:
+            print(f"Error loading {os.path.join(uploads_dir, relative_path)}: {error}")
+            continue
+        all_data.append(df)
+        loaded[relative_path] = manifest[relative_path]
+        print(f"Loaded {len(df)} packets from {relative_path}")
     
     if not all_data:
         return None
     
     combined_df = pd.concat(all_data, ignore_index=True)
-    # Convert ESP32 millisecond timestamps to datetime for analysis
-    combined_df['timestamp'] = pd.to_datetime(combined_df['timestamp'], unit='ms', origin='unix')
+    if use_cache:
+        try:
+            _save_upload_cache(cache_dir, combined_df, loaded)
+        except OSError as e:
+            print(f"Error writing upload cache: {e}")
     
     print(f"Total packets loaded: {len(combined_df)}")
     return combined_df
 
-def calculate_packet_delivery_metrics(df):
+def load_columnar_packet_data(columnar_dir=os.path.join('uploads', 'columnar'), columns=None):
+    """
+    Reads the server's Parquet raw uploads (--storage parquet), loading only the requested columns.
+    Files still being written are named *.parquet.tmp and not read; any other file without a
+    valid footer (e.g. left by a crash) is skipped with a message.
+    """
+    upload_files = sorted(glob.glob(os.path.join(columnar_dir, 'upload_*.parquet')))
+    if not upload_files:
+        print(f"No columnar upload files found in {columnar_dir}/")
+        return None
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    print(f"Found {len(upload_files)} columnar upload files")
+    tables = []
+    for file_path in upload_files:
+        try:
+            tables.append(pq.read_table(file_path, columns=columns))
+        except (OSError, pa.ArrowInvalid) as e:
+            print(f"Error loading {file_path}: {e}")
+    if not tables:
+        return None
+    # Dictionary-encoded ID columns come back as categoricals
+    combined_df = pa.concat_tables(tables).to_pandas()
+    if 'timestamp' in combined_df.columns:
+        # Same ESP32 millisecond conversion as the CSV loader
+        combined_df['timestamp'] = pd.to_datetime(combined_df['timestamp'], unit='ms', origin='unix')
+
+    print(f"Total packets loaded: {len(combined_df)}")
+    return combined_df
+
+def _stored_twice(frames, key=PACKET_KEY_COLUMNS):
+    """
+    Marks the rows of the concatenated frames whose packet an earlier frame already holds:
+    the n-th copy of a key in one frame matches the n-th copy in another, and repeats
+    within a single frame are kept.
+    """
+    numbered = []
+    for frame in frames:
+        # Same value types whichever format the rows came from (float32 vs int8 RSSI, categorical IDs)
+        keys = pd.DataFrame({
+            column: frame[column].astype('float64') if column == 'rssi' else
+                    frame[column] if column == 'timestamp' else
+                    frame[column].astype('object').fillna('').astype(str)
+            for column in key
+        })
+        numbered.append(keys.assign(_copy=keys.groupby(list(keys.columns), sort=False).cumcount().to_numpy()))
+    return pd.concat(numbered, ignore_index=True).duplicated().to_numpy()
+
+def merge_packet_sources(frames, key=PACKET_KEY_COLUMNS):
+    """
+    Combines packets loaded from different storage formats. --storage both writes every
+    row to CSV and Parquet, so a row found in several sources counts once.
+    """
+    combined = pd.concat(frames, ignore_index=True)
+    merged = combined[~_stored_twice(frames, key)].reset_index(drop=True)
+    if len(merged) < len(combined):
+        print(f"Dropped {len(combined) - len(merged)} packets stored in both CSV and Parquet")
+    return merged
+
+def load_packet_data(uploads_dir='uploads'):
+    """Raw packets from the CSV uploads and the server's Parquet uploads together"""
+    frames = []
+    columnar_dir = os.path.join(uploads_dir, 'columnar')
+    if glob.glob(os.path.join(columnar_dir, 'upload_*.parquet')):
+        frames.append(load_columnar_packet_data(columnar_dir, columns=PACKET_COLUMNS))
+    if glob.glob(os.path.join(uploads_dir, '**', 'upload_*.csv'), recursive=True):
+        frames.append(load_raw_packet_data(uploads_dir))
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    combined_df = merge_packet_sources(frames)
+    print(f"Total packets after merging CSV and Parquet uploads: {len(combined_df)}")
+    return combined_df
+
+def device_accumulators(df, proximity=None):
+    """
+    Mergeable per-device state for a frame of packets: counts, time bounds, RSSI
+    sums and the count/mean/M2 of the packet intervals. Indexed by manufacturer_data.
+    With a rssi_calibration.ProximityFilter, also counts the packets whose smoothed
+    RSSI is within its distance. RSSI is smoothed per observer (sender_id) and device,
+    the key the server filters by, and the filter carries each pair's average to the next frame.
+    """
+    # Integer device codes in sorted key order, matching groupby; rows without a key are dropped like groupby does
+    codes, devices = pd.factorize(df['manufacturer_data'], sort=True)
+    has_device = codes >= 0
+    if not has_device.all():
+        df = df[has_device]
+        codes = codes[has_device]
+    n_devices = len(devices)
+    
+    # One stable sort by device then time puts every device's packets in order
+    timestamps = df['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+    order = np.lexsort((timestamps, codes))
+    sorted_codes = codes[order]
+    sorted_ts = timestamps[order]
+    
+    starts = np.flatnonzero(np.r_[len(sorted_codes) > 0, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(sorted_codes)][:len(starts)] - 1
+    rssi = df['rssi'].to_numpy(dtype=float)
+    has_rssi = ~np.isnan(rssi)
+    if proximity is not None:
+        # Smoothed in time order within each observer/device pair; the rows are already in
+        # time order per device, so they are per pair too
+        if 'sender_id' in df.columns:
+            sender_codes, senders = pd.factorize(df['sender_id'].fillna('').to_numpy()[order])
+        else:
+            sender_codes, senders = np.zeros(len(order), dtype='int64'), np.array([''])
+        pair_codes, pairs = pd.factorize(sender_codes * n_devices + sorted_codes)
+        keys = pair_keys(np.asarray(senders)[pairs // n_devices], np.asarray(devices)[pairs % n_devices])
+        near = proximity.near(pair_codes, keys.tolist(), rssi[order]) & has_rssi[order]
+        near_count = np.bincount(sorted_codes[near], minlength=n_devices)
+    else:
+        near_count = np.zeros(n_devices, dtype='int64')
+    
+    # Packet delivery intervals: consecutive differences that stay within one device
+    same_device = sorted_codes[1:] == sorted_codes[:-1]
+    interval_codes = sorted_codes[1:][same_device]
+    intervals = np.diff(sorted_ts)[same_device] / 1e9
+    interval_count = np.bincount(interval_codes, minlength=n_devices)
+    interval_mean = np.divide(np.bincount(interval_codes, weights=intervals, minlength=n_devices),
+                              interval_count, out=np.zeros(n_devices), where=interval_count > 0)
+    # Squared deviations around each device's mean, which np.std would also use
+    deviations = intervals - interval_mean[interval_codes]
+    
+    if 'device_name' in df.columns:
+        # First row of each device in the original order
+        _, first_rows = np.unique(codes, return_index=True)
+        device_names = df['device_name'].to_numpy()[first_rows]
+    else:
+        device_names = 'Unknown'
+    
+    return pd.DataFrame({
+        'device_name': device_names,
+        'total_packets': ends - starts + 1,
+        'first_ns': sorted_ts[starts],
+        'last_ns': sorted_ts[ends],
+        'rssi_sum': np.bincount(codes[has_rssi], weights=rssi[has_rssi], minlength=n_devices),
+        'rssi_count': np.bincount(codes[has_rssi], minlength=n_devices),
+        'near_count': near_count,
+        'interval_count': interval_count,
+        'interval_mean': interval_mean,
+        'interval_m2': np.bincount(interval_codes, weights=deviations ** 2, minlength=n_devices),
+    }, index=pd.Index(np.asarray(devices), name='manufacturer_data'))
+
+def merge_device_accumulators(earlier, later):
+    """
+    Combines device_accumulators of two stretches of packets, where later's packets
+    come after earlier's for each device. The gap between the two stretches counts
+    as one more interval, merged with Chan et al.'s parallel variance update.
+    Returns the merged accumulators and how many devices broke the ordering assumption.
+    """
+    if earlier is None:
+        return later, 0
+    both = earlier.index.intersection(later.index)
+    if both.empty:
+        return pd.concat([earlier, later]), 0
+    
+    a = earlier.loc[both]
+    b = later.loc[both]
+    boundary = (b['first_ns'] - a['last_ns']) / 1e9
+    
+    # Add the boundary interval to a's interval state
+    n_a = a['interval_count'] + 1
+    delta = boundary - a['interval_mean']
+    mean_a = a['interval_mean'] + delta / n_a
+    m2_a = a['interval_m2'] + delta * (boundary - mean_a)
+    # Then merge in b's interval state
+    n = n_a + b['interval_count']
+    delta = b['interval_mean'] - mean_a
+    merged = pd.DataFrame({
+        'device_name': a['device_name'],
+        'total_packets': a['total_packets'] + b['total_packets'],
+        'first_ns': np.minimum(a['first_ns'], b['first_ns']),
+        'last_ns': np.maximum(a['last_ns'], b['last_ns']),
+        'rssi_sum': a['rssi_sum'] + b['rssi_sum'],
+        'rssi_count': a['rssi_count'] + b['rssi_count'],
+        'near_count': a['near_count'] + b['near_count'],
+        'interval_count': n,
+        'interval_mean': mean_a + delta * b['interval_count'] / n,
+        'interval_m2': m2_a + b['interval_m2'] + delta ** 2 * n_a * b['interval_count'] / n,
+    }, index=both)
+    out_of_order = int((boundary < 0).sum())
+    return pd.concat([earlier.drop(both), merged, later.drop(both)]), out_of_order
+
+def device_stats_from_accumulators(acc, proximity=None):
+    """Turns device_accumulators into the calculate_packet_delivery_metrics output frame"""
+    acc = acc.sort_index()
+    n_devices = len(acc)
+    total_packets = acc['total_packets'].to_numpy()
+    time_span = (acc['last_ns'].to_numpy() - acc['first_ns'].to_numpy()) / 1e9
+    interval_count = acc['interval_count'].to_numpy()
+    has_intervals = interval_count > 0
+    
+    device_stats = pd.DataFrame({
+        'manufacturer_data': acc.index.to_numpy(),
+        'device_name': acc['device_name'].to_numpy(),
+        'total_packets': total_packets,
+        'time_span_seconds': time_span,
+        # Calculating packet delivery rate over time
+        'packet_rate_pps': np.divide(total_packets, time_span, out=np.zeros(n_devices), where=time_span > 0),
+        'avg_rssi': np.divide(acc['rssi_sum'].to_numpy(), acc['rssi_count'].to_numpy(),
+                              out=np.full(n_devices, np.nan), where=acc['rssi_count'].to_numpy() > 0),
+        'avg_interval_seconds': np.where(has_intervals, acc['interval_mean'].to_numpy(), 0),
+        'std_interval_seconds': np.sqrt(np.divide(acc['interval_m2'].to_numpy(), interval_count,
+                                                  out=np.zeros(n_devices), where=has_intervals)),
+        'first_seen': pd.to_datetime(acc['first_ns'].to_numpy(), unit='ns'),
+        'last_seen': pd.to_datetime(acc['last_ns'].to_numpy(), unit='ns'),
+    })
+    if proximity is not None:
+        # Distance implied by the average RSSI, and the share of packets that were close enough to count
+        device_stats['est_distance_m'] = proximity.model.distance(device_stats['avg_rssi'].to_numpy())
+        device_stats['near_share'] = np.divide(acc['near_count'].to_numpy(), acc['rssi_count'].to_numpy(),
+                                               out=np.full(n_devices, np.nan), where=acc['rssi_count'].to_numpy() > 0)
+    return device_stats
+
+def calculate_packet_delivery_metrics(df, proximity=None):
     """Measures packet reception reliability and timing consistency per device to identify signal quality issues"""
     if df is None or df.empty:
         return None
-    
-    device_stats = []
-    
-    for device, group in df.groupby('manufacturer_data'):
-        total_packets = len(group)
-        time_span = (group['timestamp'].max() - group['timestamp'].min()).total_seconds()
-        
-        # Calculating packet delivery rate over time
-        packet_rate = total_packets / time_span if time_span > 0 else 0
-        avg_rssi = group['rssi'].mean()
-        
-        # Packet  delivery intervals
-        group_sorted = group.sort_values('timestamp')
-        intervals = []
-        for i in range(1, len(group_sorted)):
-            interval = (group_sorted.iloc[i]['timestamp'] - group_sorted.iloc[i-1]['timestamp']).total_seconds()
-            intervals.append(interval)
-        
-        avg_interval = np.mean(intervals) if intervals else 0
-        std_interval = np.std(intervals) if intervals else 0
+    return device_stats_from_accumulators(device_accumulators(df, proximity), proximity)
+
+def hourly_packet_counts(timestamps):
+    """Packets per hour bucket, the mergeable part of plot_packet_rate_over_time's resample"""
+    return timestamps.dt.floor('h').value_counts()
+
+def hourly_packet_rate(hourly_counts):
+    """Fills empty hours like resample('1H').size() and converts counts to packets per second"""
+    hourly_counts = hourly_counts.sort_index()
+    hours = pd.date_range(hourly_counts.index.min(), hourly_counts.index.max(), freq='h')
+    df_hourly = hourly_counts.reindex(hours, fill_value=0).rename_axis('timestamp').reset_index()
+    df_hourly.columns = ['timestamp', 'packet_count']
+    df_hourly['packet_rate_pps'] = df_hourly['packet_count'] / 3600
+    return df_hourly
+
+def _upload_chunk_readers(uploads_dir, chunk_size):
+    """(source, file path, chunk reader) per upload file, Parquet (source 0) then CSV (1) as load_packet_data reads them"""
+    readers = []
+    parquet_files = sorted(glob.glob(os.path.join(uploads_dir, 'columnar', 'upload_*.parquet')))
+    if parquet_files:
+        import pyarrow.parquet as pq
+        for file_path in parquet_files:
+            readers.append((0, file_path, lambda file_path=file_path: (
+                batch.to_pandas() for batch in
+                pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size, columns=PACKET_COLUMNS))))
+    for file_path in sorted(glob.glob(os.path.join(uploads_dir, '**', 'upload_*.csv'), recursive=True)):
+        readers.append((1, file_path, lambda file_path=file_path: pd.read_csv(
+            file_path, dtype=UPLOAD_DTYPES, chunksize=chunk_size)))
+    return readers
+
+def _sorted_runs(parts, chunk_size, low, width):
+    """
+    Yields the spilled rows of parts, [(path, rows)] all within [low, low + width) ms, sorted by
+    device timestamp then read order, in runs of at most chunk_size rows unless they share one timestamp
+    """
+    if sum(rows for _, rows in parts) <= chunk_size or width <= 1:
+        run = pd.concat([pd.read_pickle(path) for path, _ in parts], ignore_index=True)
+        yield run.sort_values(['timestamp', '_seq'], ignore_index=True)
+        return
+    # Too many rows to sort at once: split the range and spill each part again
+    sub_width = -(-width // STREAM_SPLIT)
+    sub_parts = {}
+    for path, _ in parts:
+        part = pd.read_pickle(path)
+        os.remove(path)
+        for sub, rows in part.groupby((part['timestamp'].to_numpy() - low) // sub_width, sort=False):
+            rows.to_pickle(f'{path}.{sub}')
+            sub_parts.setdefault(sub, []).append((f'{path}.{sub}', len(rows)))
+    for sub in sorted(sub_parts):
+        yield from _sorted_runs(sub_parts[sub], chunk_size, low + sub * sub_width, sub_width)
+
+def stream_packet_metrics(uploads_dir='uploads', chunk_size=500000, proximity=None):
+    """
+    Out-of-core version of calculate_packet_delivery_metrics and calculate_overall_delivery_rate
+    over load_packet_data's packets. Observers upload a device's packets at different times, so
+    files are not in device time order: they are read chunk by chunk and spilled to disk in
+    buckets of device timestamp, and the buckets are then sorted and folded into per-device
+    accumulators in time order, at most chunk_size rows at a time. The boundary interval of each
+    device, and with a ProximityFilter each pair's smoothed RSSI, carry from one run to the next,
+    so the results are those of the in-memory path. Memory grows with the number of devices and
+    chunk_size; the spilled copy of the packets goes under uploads_dir/.cache.
+    Returns (device_stats, overall_metrics, hourly_counts).
+    """
+    readers = _upload_chunk_readers(uploads_dir, chunk_size)
+    if not readers:
+        print(f"No upload files found in {uploads_dir}/")
+        return None, None, None
+    print(f"Streaming {len(readers)} upload files in chunks of {chunk_size} rows")
+    
+    cache_dir = os.path.join(uploads_dir, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix='stream_', dir=cache_dir)
+    try:
+        # Pass 1: spill every row by device timestamp bucket, numbered in read order
+        buckets = {}
+        sources = set()
+        seq = 0
+        n_parts = 0
+        for source, file_path, read_chunks in readers:
+            file_parts = []
+            try:
+                for chunk in read_chunks():
+                    # Early firmware logged no manufacturer_data; like in the in-memory path, such
+                    # packets count towards the overall metrics but not towards any device
+                    chunk = chunk.reindex(columns=PACKET_COLUMNS).astype(
+                        {'device_address': object, 'device_name': object, 'manufacturer_data': object,
+                         'sender_id': object, 'rssi': 'float64'})
+                    chunk['_seq'] = np.arange(seq, seq + len(chunk))
+                    chunk['_source'] = source
+                    seq += len(chunk)
+                    for bucket, rows in chunk.groupby(chunk['timestamp'].to_numpy() // STREAM_BUCKET_MS, sort=False):
+                        path = os.path.join(spill_dir, f'{n_parts}.pkl')
+                        n_parts += 1
+                        rows.to_pickle(path)
+                        file_parts.append((bucket, path, len(rows)))
+            except Exception as e:
+                # A file that cannot be read counts for nothing, as when it is loaded whole
+                print(f"Error loading {file_path}: {e}")
+                for _, path, _ in file_parts:
+                    os.remove(path)
+                continue
+            for bucket, path, rows in file_parts:
+                buckets.setdefault(bucket, []).append((path, rows))
+            sources.add(source)
         
-        device_stats.append({
-            'manufacturer_data': device,
-            'device_name': group['device_name'].iloc[0] if 'device_name' in group.columns else 'Unknown',
-            'total_packets': total_packets,
-            'time_span_seconds': time_span,
-            'packet_rate_pps': packet_rate,
-            'avg_rssi': avg_rssi,
-            'avg_interval_seconds': avg_interval,
-            'std_interval_seconds': std_interval,
-            'first_seen': group['timestamp'].min(),
-            'last_seen': group['timestamp'].max()
-        })
-    
-    return pd.DataFrame(device_stats)
+        # Pass 2: fold the buckets in device time order
+        accumulators = None
+        first_rows = None
+        hourly_counts = None
+        total_packets = 0
+        first_ns = last_ns = None
+        for bucket in sorted(buckets):
+            for run in _sorted_runs(buckets[bucket], chunk_size, bucket * STREAM_BUCKET_MS, STREAM_BUCKET_MS):
+                if len(sources) > 1:
+                    # Copies of a packet share its timestamp, so they all land in this run
+                    csv_rows = run['_source'].to_numpy() == 1
+                    both = np.r_[np.flatnonzero(~csv_rows), np.flatnonzero(csv_rows)]
+                    run = run.drop(both[_stored_twice([run[~csv_rows], run[csv_rows]])])
+                run = run.assign(timestamp=pd.to_datetime(run['timestamp'], unit='ms', origin='unix'))
+                # Rows are in time order, so each device's part of the run comes after its last one
+                accumulators, _ = merge_device_accumulators(accumulators, device_accumulators(run, proximity))
+                # device_name is that of the device's first row in read order, not in time order
+                firsts = run.loc[run.groupby('manufacturer_data')['_seq'].idxmin(),
+                                 ['manufacturer_data', '_seq', 'device_name']]
+                first_rows = firsts if first_rows is None else pd.concat([first_rows, firsts]).sort_values(
+                    '_seq').drop_duplicates('manufacturer_data')
+                
+                total_packets += len(run)
+                timestamps = run['timestamp'].to_numpy(dtype='datetime64[ns]').view('int64')
+                first_ns = timestamps[0] if first_ns is None else min(first_ns, timestamps[0])
+                last_ns = timestamps[-1] if last_ns is None else max(last_ns, timestamps[-1])
+                counts = hourly_packet_counts(run['timestamp'])
+                hourly_counts = counts if hourly_counts is None else hourly_counts.add(counts, fill_value=0)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    
+    if accumulators is None:
+        return None, None, None
+    if first_rows is not None:
+        accumulators['device_name'] = first_rows.set_index('manufacturer_data')['device_name'].reindex(
+            accumulators.index).to_numpy()
+    print(f"Total packets streamed: {total_packets}")
+    
+    # Same figures as calculate_overall_delivery_rate, from the running totals
+    expected_interval = 10  # seconds
+    total_time_span = (last_ns - first_ns) / 1e9
+    total_expected_packets = total_time_span / expected_interval * len(accumulators)
+    overall_metrics = {
+        'total_expected_packets': total_expected_packets,
+        'total_actual_packets': total_packets,
+        'delivery_rate': total_packets / total_expected_packets if total_expected_packets > 0 else 0,
+        'total_devices': len(accumulators),
+        'total_time_span_hours': total_time_span / 3600
+    }
+    return device_stats_from_accumulators(accumulators, proximity), overall_metrics, hourly_counts.astype('int64')
 
 def calculate_overall_delivery_rate(df):
     """Compares actual vs expected packet reception to quantify system performance against theoretical maximum"""
@@ -116,7 +561,7 @@ def calculate_overall_delivery_rate(df):
         'total_time_span_hours': total_time_span / 3600
     }
 
-def plot_packet_delivery_histogram(device_stats, save_path='plots/packet_delivery_histogram.png'):
+def plot_packet_delivery_histogram(device_stats, save_path='plots/packet_delivery_histogram.png', show=True):
     """Plot histogram of packet delivery rates per device"""
     plt.figure(figsize=(10, 6))
     
@@ -133,9 +578,12 @@ def plot_packet_delivery_histogram(device_stats, save_path='plots/packet_deliver
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
     plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
-def plot_rssi_vs_packet_rate(device_stats, save_path='plots/rssi_vs_packet_rate.png'):
+def plot_rssi_vs_packet_rate(device_stats, save_path='plots/rssi_vs_packet_rate.png', show=True):
     """Plot RSSI vs packet delivery rate"""
     plt.figure(figsize=(10, 6))
     
@@ -159,9 +607,12 @@ def plot_rssi_vs_packet_rate(device_stats, save_path='plots/rssi_vs_packet_rate.
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
     plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
-def plot_packet_intervals(device_stats, save_path='plots/packet_intervals.png'):
+def plot_packet_intervals(device_stats, save_path='plots/packet_intervals.png', show=True):
     """Identifies timing consistency issues"""
     plt.figure(figsize=(10, 6))
     
@@ -177,14 +628,18 @@ def plot_packet_intervals(device_stats, save_path='plots/packet_intervals.png'):
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
     plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
-def plot_packet_rate_over_time(df, save_path='plots/packet_rate_over_time.png'):
+def plot_packet_rate_over_time(df, save_path='plots/packet_rate_over_time.png', df_hourly=None, show=True):
     """Tracks system performance over time to identify degradation or improvement patterns"""
     # Hourly aggregation reveals temporal patterns in reception quality
-    df_hourly = df.set_index('timestamp').resample('1H').size().reset_index()
-    df_hourly.columns = ['timestamp', 'packet_count']
-    df_hourly['packet_rate_pps'] = df_hourly['packet_count'] / 3600
+    if df_hourly is None:
+        df_hourly = df.set_index('timestamp').resample('1H').size().reset_index()
+        df_hourly.columns = ['timestamp', 'packet_count']
+        df_hourly['packet_rate_pps'] = df_hourly['packet_count'] / 3600
     
     plt.figure(figsize=(12, 6))
     
@@ -200,7 +655,10 @@ def plot_packet_rate_over_time(df, save_path='plots/packet_rate_over_time.png'):
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.close()
 
 def print_packet_statistics(device_stats, overall_metrics):
     """Provides actionable insights for system optimization and troubleshooting"""
@@ -226,6 +684,9 @@ def print_packet_statistics(device_stats, overall_metrics):
         print(f"\nSignal Quality Metrics:")
         print(f"Mean RSSI: {device_stats['avg_rssi'].mean():.2f} dBm")
         print(f"Mean packet interval: {device_stats['avg_interval_seconds'].mean():.2f} seconds")
+        if 'near_share' in device_stats:
+            print(f"Median estimated distance: {device_stats['est_distance_m'].median():.2f} m")
+            print(f"Packets within contact distance: {device_stats['near_share'].mean() * 100:.1f}% (mean per device)")
         
         print("\nPERCENTILES (Packet Rate):")
         percentiles = [25, 50, 75, 90, 95, 99]
@@ -233,20 +694,206 @@ def print_packet_statistics(device_stats, overall_metrics):
             value = np.percentile(device_stats['packet_rate_pps'], p)
             print(f"{p}th percentile: {value:.3f} packets/sec")
 
-def main():
+def report_input_manifest(uploads_dir='uploads'):
+    """Every raw upload file a report reads, CSV and the server's Parquet, with its size and mtime"""
+    upload_files = glob.glob(os.path.join(uploads_dir, '**', 'upload_*.csv'), recursive=True)
+    upload_files += glob.glob(os.path.join(uploads_dir, 'columnar', 'upload_*.parquet'))
+    return _file_manifest(uploads_dir, sorted(upload_files))
+
+def _file_digest(file_path):
+    """Hash of a file's contents"""
+    with open(file_path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def _frame_digest(frame):
+    """Hash of a frame's columns and values"""
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return hashlib.blake2b(hashed.tobytes() + json.dumps(list(frame.columns)).encode(), digest_size=16).hexdigest()
+
+def compute_report_aggregates(uploads_dir='uploads', streaming=False, chunk_size=500000, proximity=None):
+    """Device stats, overall metrics and the hourly packet rate, computed once for every figure"""
+    if streaming:
+        device_stats, overall_metrics, hourly_counts = stream_packet_metrics(uploads_dir, chunk_size, proximity)
+        if device_stats is None:
+            return None
+    else:
+        df = load_packet_data(uploads_dir)
+        if df is None:
+            return None
+        device_stats = calculate_packet_delivery_metrics(df, proximity)
+        overall_metrics = calculate_overall_delivery_rate(df)
+        hourly_counts = hourly_packet_counts(df['timestamp'])
+    return {
+        'device_stats': device_stats,
+        'overall_metrics': overall_metrics,
+        'df_hourly': hourly_packet_rate(hourly_counts),
+    }
+
+def load_report_aggregates(cache_dir, key, compute):
+    """
+    The aggregates cached under cache_dir when they were built for the same key (input
+    manifest and options), otherwise compute() and cache its result. Returns (aggregates, cached).
+    """
+    cache_path = os.path.join(cache_dir, 'report_aggregates.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return cached['aggregates'], True
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+    
+    aggregates = compute()
+    if aggregates is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path + '.tmp', 'wb') as f:
+                pickle.dump({'key': key, 'aggregates': aggregates}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            print(f"Error writing report cache: {e}")
+    return aggregates, False
+
+def _render_report_plot(function_name, data, save_path):
+    """Draws one report figure with the non-interactive backend; runs in a worker process"""
+    plt.switch_backend('Agg')
+    started = time.perf_counter()
+    plot = globals()[function_name]
+    if function_name == 'plot_packet_rate_over_time':
+        plot(None, save_path=save_path, df_hourly=data, show=False)
+    else:
+        plot(data, save_path=save_path, show=False)
+    return time.perf_counter() - started
+
+def render_report_plots(aggregates, plots_dir='plots', state_path=None, workers=None):
+    """
+    Draws REPORT_PLOTS in parallel worker processes. The hash of each figure's input
+    columns is kept in state_path, and a figure whose hash matches and whose file
+    still exists is not drawn again. Returns the number of figures drawn.
+    """
+    state = {}
+    if state_path is not None:
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+    
+    jobs = []
+    for function_name, source, columns, filename in REPORT_PLOTS:
+        frame = aggregates.get(source)
+        if frame is None or frame.empty:
+            continue
+        data = frame[columns]
+        save_path = os.path.join(plots_dir, filename)
+        digest = _frame_digest(data)
+        if state.get(save_path) == digest and os.path.exists(save_path):
+            print(f"Unchanged, not redrawn: {save_path}")
+            continue
+        jobs.append((function_name, data, save_path, digest))
+    
+    drawn = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(jobs))) as pool:
+            futures = [(pool.submit(_render_report_plot, function_name, data, save_path), save_path, digest)
+                       for function_name, data, save_path, digest in jobs]
+            for future, save_path, digest in futures:
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f"Error drawing {save_path}: {e}")
+                    state.pop(save_path, None)
+                    continue
+                state[save_path] = digest
+                drawn += 1
+                print(f"Drew {save_path} in {seconds:.1f} s")
+    
+    if state_path is not None:
+        with open(state_path, 'w') as f:
+            json.dump(state, f, indent=1)
+    return drawn
+
+def run_report(uploads_dir='uploads', plots_dir='plots', streaming=False, chunk_size=500000,
+               proximity=None, workers=None, calibration_file=CALIBRATION_FILE):
+    """
+    Headless batch report: aggregates computed once and cached against the input manifest
+    (and the calibration proximity was fitted from), statistics printed, figures drawn in
+    parallel and only when their inputs changed.
+    """
+    started = time.perf_counter()
+    cache_dir = os.path.join(uploads_dir, CACHE_DIR_NAME)
+    options = {
+        'streaming': streaming,
+        'environment': proximity.model.environment if proximity is not None else None,
+        'max_distance': proximity.max_distance if proximity is not None else None,
+        'model': list(proximity.model) if proximity is not None else None,
+        'alpha': proximity.alpha if proximity is not None else None,
+        'calibration': _file_digest(calibration_file) if proximity is not None else None,
+    }
+    key = hashlib.blake2b(json.dumps([report_input_manifest(uploads_dir), options], sort_keys=True).encode(),
+                          digest_size=16).hexdigest()
+    aggregates, cached = load_report_aggregates(
+        cache_dir, key, lambda: compute_report_aggregates(uploads_dir, streaming, chunk_size, proximity))
+    if aggregates is None:
+        print(f"No data to analyze. Please ensure upload files exist in the '{uploads_dir}' directory.")
+        return
+    print(f"{'Loaded cached' if cached else 'Computed'} aggregates in {time.perf_counter() - started:.1f} s")
+    
+    device_stats = aggregates['device_stats']
+    print_packet_statistics(device_stats, aggregates['overall_metrics'])
+    
+    os.makedirs(plots_dir, exist_ok=True)
+    print("\nGenerating plots...")
+    drawn = render_report_plots(aggregates, plots_dir, os.path.join(cache_dir, 'report_plots.json'), workers)
+    
+    results_path = os.path.join(plots_dir, 'packet_analysis_results.csv')
+    if not cached or not os.path.exists(results_path):
+        device_stats.to_csv(results_path, index=False)
+    print(f"\nReport complete in {time.perf_counter() - started:.1f} s: {drawn} of {len(REPORT_PLOTS)} plots drawn, "
+          f"results in {results_path}")
+
+def main(streaming=False, chunk_size=500000, environment=None, max_distance=MAX_CONTACT_DISTANCE,
+         report=False, workers=None, calibration_file=CALIBRATION_FILE):
     """Analyzes BLE packet reception performance to optimize contact tracing system reliability"""
     print("Starting BLE Packet Delivery Analysis...")
     
-    # Load raw packet data
-    df = load_raw_packet_data()
-    if df is None:
-        print("No data to analyze. Please ensure upload files exist in the 'uploads' directory.")
+    proximity = None
+    if environment:
+        # Per-device distance estimates from the path loss model fitted for this environment
+        models = load_calibration(calibration_file)
+        if environment not in models:
+            print(f"Unknown environment {environment!r}, calibrated environments: {', '.join(sorted(models))}")
+            return
+        proximity = ProximityFilter(models[environment], max_distance)
+        print(f"Proximity: {environment} model, within {max_distance:g} m means RSSI >= {proximity.threshold:.1f} dBm")
+    
+    if report:
+        # Headless: nothing is shown, figures are drawn by worker processes
+        plt.switch_backend('Agg')
+        run_report(streaming=streaming, chunk_size=chunk_size, proximity=proximity, workers=workers,
+                   calibration_file=calibration_file)
         return
     
-    # Calculate packet delivery metrics
-    print("\nCalculating packet delivery metrics...")
-    device_stats = calculate_packet_delivery_metrics(df)
-    overall_metrics = calculate_overall_delivery_rate(df)
+    df = None
+    df_hourly = None
+    if streaming:
+        # Fold packets into per-device state in time order, chunk by chunk, instead of loading every packet
+        device_stats, overall_metrics, hourly_counts = stream_packet_metrics(chunk_size=chunk_size, proximity=proximity)
+        if device_stats is None:
+            print("No data to analyze. Please ensure upload files exist in the 'uploads' directory.")
+            return
+        df_hourly = hourly_packet_rate(hourly_counts)
+    else:
+        # Load raw packet data from the CSV and the server's columnar uploads
+        df = load_packet_data()
+        if df is None:
+            print("No data to analyze. Please ensure upload files exist in the 'uploads' directory.")
+            return
+        
+        # Calculate packet delivery metrics
+        print("\nCalculating packet delivery metrics...")
+        device_stats = calculate_packet_delivery_metrics(df, proximity)
+        overall_metrics = calculate_overall_delivery_rate(df)
     
     print_packet_statistics(device_stats, overall_metrics)
     
@@ -259,7 +906,7 @@ def main():
         plot_rssi_vs_packet_rate(device_stats)
         plot_packet_intervals(device_stats)
     
-    plot_packet_rate_over_time(df)
+    plot_packet_rate_over_time(df, df_hourly=df_hourly)
     
     if device_stats is not None:
         device_stats.to_csv('plots/packet_analysis_results.csv', index=False)
@@ -268,4 +915,24 @@ def main():
     print("\nPacket analysis complete! All plots saved to the 'plots' directory.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="BLE packet delivery analysis")
+    parser.add_argument('--streaming', action='store_true',
+                        help="process upload files chunk by chunk with bounded memory")
+    parser.add_argument('--chunk-size', type=int, default=500000,
+                        help="rows per chunk in --streaming mode")
+    parser.add_argument('--environment',
+                        help="estimate distances with the RSSI path loss model fitted for this environment "
+                             "of plots/rssi_vs_distance.csv ('all' pools every environment)")
+    parser.add_argument('--max-distance', type=float, default=MAX_CONTACT_DISTANCE,
+                        help="metres counted as a contact with --environment")
+    parser.add_argument('--calibration-file', default=CALIBRATION_FILE,
+                        help="RSSI/distance readings the --environment models are fitted from")
+    parser.add_argument('--report', action='store_true',
+                        help="headless batch report: cached aggregates, figures drawn in parallel and only "
+                             "when their inputs changed, nothing shown on screen")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes drawing figures in --report mode (default: one per CPU)")
+    args = parser.parse_args()
+    main(streaming=args.streaming, chunk_size=args.chunk_size, environment=args.environment,
+         max_distance=args.max_distance, report=args.report, workers=args.workers,
+         calibration_file=args.calibration_file) 
\ No newline at end of file
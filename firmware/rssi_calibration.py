@@ -0,0 +1,202 @@
+import argparse
+import csv
+import os
+from collections import OrderedDict, namedtuple
+from itertools import compress
+
+import numpy as np
+import pandas as pd
+
+# Measured RSSI at known distances, one row per reading: distance (m), rssi (dBm), environment
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plots', 'rssi_vs_distance.csv')
+POOLED_ENVIRONMENT = 'all'
+
+# Readings closer than this are in the antenna near field and don't follow the log-distance model
+MIN_FIT_DISTANCE = 0.1      # metres
+REFERENCE_DISTANCE = 1.0    # metres, rssi_at_ref is the expected RSSI here
+
+MAX_CONTACT_DISTANCE = 2.0  # metres, the exposure rule's "within ~2 meters"
+SMOOTHING_ALPHA = 0.3       # weight of the newest sample in the per-contact moving average
+MAX_SMOOTHED_KEYS = 100000  # contacts whose smoothed RSSI is remembered between batches
+
+
+class PathLossModel(namedtuple('PathLossModel', 'environment rssi_at_ref exponent samples rmse')):
+    """
+    Log-distance path loss: rssi = rssi_at_ref - 10 * exponent * log10(distance / REFERENCE_DISTANCE).
+    Both directions take scalars or NumPy arrays.
+    """
+    __slots__ = ()
+
+    def rssi_at(self, distance):
+        return self.rssi_at_ref - 10 * self.exponent * np.log10(np.asarray(distance, dtype=float) / REFERENCE_DISTANCE)
+
+    def distance(self, rssi):
+        return REFERENCE_DISTANCE * 10 ** ((self.rssi_at_ref - np.asarray(rssi, dtype=float)) / (10 * self.exponent))
+
+
+def fit_path_loss(distance, rssi, environment=POOLED_ENVIRONMENT, exponent=None):
+    """
+    Least-squares fit of a PathLossModel to readings at MIN_FIT_DISTANCE or further.
+    With a fixed exponent, or readings at a single distance, only rssi_at_ref is fitted.
+    """
+    distance = np.asarray(distance, dtype=float)
+    rssi = np.asarray(rssi, dtype=float)
+    keep = distance >= MIN_FIT_DISTANCE
+    distance, rssi = distance[keep], rssi[keep]
+    if not len(distance):
+        raise ValueError(f"No calibration readings for {environment} at {MIN_FIT_DISTANCE} m or more")
+    x = -10 * np.log10(distance / REFERENCE_DISTANCE)
+    if exponent is None and len(np.unique(distance)) > 1:
+        exponent, rssi_at_ref = np.polyfit(x, rssi, 1)
+    else:
+        if exponent is None:
+            raise ValueError(f"Readings for {environment} are all at one distance, an exponent is needed")
+        rssi_at_ref = float(np.mean(rssi - exponent * x))
+    residuals = rssi - (rssi_at_ref + exponent * x)
+    return PathLossModel(environment, float(rssi_at_ref), float(exponent), len(distance),
+                         float(np.sqrt(np.mean(residuals ** 2))))
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """
+    Fits one PathLossModel per environment in the calibration CSV, plus a pooled
+    POOLED_ENVIRONMENT model. Environments measured at a single distance reuse
+    the pooled exponent. Returns {environment: PathLossModel}.
+    """
+    with open(path, newline='') as f:
+        readings = [(float(row['distance']), float(row['rssi']), row['environment']) for row in csv.DictReader(f)]
+    distance = np.array([reading[0] for reading in readings])
+    rssi = np.array([reading[1] for reading in readings])
+    environments = np.array([reading[2] for reading in readings])
+
+    pooled = fit_path_loss(distance, rssi)
+    models = {POOLED_ENVIRONMENT: pooled}
+    for environment in np.unique(environments):
+        selected = environments == environment
+        single_distance = len(np.unique(distance[selected & (distance >= MIN_FIT_DISTANCE)])) < 2
+        models[str(environment)] = fit_path_loss(distance[selected], rssi[selected], str(environment),
+                                                 pooled.exponent if single_distance else None)
+    return models
+
+
+def rssi_values(column):
+    """RSSI column (ints or the CSV's strings) as a float array, with NaN where it isn't a number"""
+    try:
+        return np.asarray(column, dtype=float)
+    except ValueError:
+        values = np.full(len(column), np.nan)
+        for i, value in enumerate(column):
+            try:
+                values[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return values
+
+
+def grouped_ewma(codes, values, alpha, initial=None):
+    """
+    Exponentially weighted moving average of values within each group, in row order.
+    codes are group numbers 0..n_groups-1; initial holds each group's previous average
+    (NaN to start from the group's first value). NaN values leave the average unchanged.
+    Returns (smoothed values in the input order, last average per group).
+
+    pandas' grouped ewm runs the recurrence in compiled code; each group's previous
+    average goes in as a leading row so the recurrence continues from it.
+    """
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=float)
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    state = np.full(n_groups, np.nan) if initial is None else np.array(initial, dtype=float)
+    if not len(codes):
+        return np.empty(0), state
+
+    seeded = np.flatnonzero(~np.isnan(state))
+    smoothed = (pd.Series(np.r_[state[seeded], values])
+                .groupby(np.r_[seeded, codes], sort=False)
+                .ewm(alpha=alpha, adjust=False, ignore_na=True)
+                .mean())
+    # Indexed by (group, row); rows back in input order, without the seed rows
+    result = smoothed.droplevel(0).sort_index().to_numpy()[len(seeded):]
+    last = smoothed.groupby(level=0).last()
+    state[last.index.to_numpy()] = last.to_numpy()
+    return result, state
+
+
+def pair_keys(sender_id, manufacturer_data):
+    """'sender_id/manufacturer_data' key of each observer/observed pair, missing IDs as ''"""
+    sender_id = pd.Series(sender_id, dtype=object).fillna('').astype(str).to_numpy(dtype=str)
+    manufacturer_data = pd.Series(manufacturer_data, dtype=object).fillna('').astype(str).to_numpy(dtype=str)
+    return np.char.add(np.char.add(sender_id, '/'), manufacturer_data)
+
+
+class ProximityFilter:
+    """
+    Classifies sightings as within max_distance of the observer under a
+    PathLossModel. The distance is converted to an RSSI threshold once, so
+    classifying a batch is one array comparison. RSSI is smoothed per key
+    (one observer/observed pair) with grouped_ewma before the comparison, and
+    each key's average carries over to its next batch. Sightings without an
+    RSSI are kept.
+    """
+    def __init__(self, model, max_distance=MAX_CONTACT_DISTANCE, alpha=SMOOTHING_ALPHA, max_keys=MAX_SMOOTHED_KEYS):
+        self.model = model
+        self.max_distance = max_distance
+        self.alpha = alpha
+        self.max_keys = max_keys
+        self.threshold = float(model.rssi_at(max_distance))
+        self._smoothed = OrderedDict()  # key -> last smoothed RSSI, least recently seen first
+
+    def __len__(self):
+        return len(self._smoothed)
+
+    def classify(self, rssi):
+        """True where an (already smoothed) RSSI array is within max_distance"""
+        rssi = np.asarray(rssi, dtype=float)
+        return (rssi >= self.threshold) | np.isnan(rssi)
+
+    def smooth(self, codes, keys, rssi):
+        """Smoothed RSSI for rows of the groups codes index into keys, continuing each key's average"""
+        smoothed = self._smoothed
+        initial = np.array([smoothed.get(key, np.nan) for key in keys], dtype=float)
+        result, last = grouped_ewma(codes, rssi, self.alpha, initial)
+        for key, average in zip(keys, last.tolist()):
+            if average == average:
+                smoothed[key] = average
+                smoothed.move_to_end(key)
+        if len(smoothed) > self.max_keys:
+            for _ in range(len(smoothed) - self.max_keys):
+                smoothed.popitem(last=False)
+        return result
+
+    def near(self, codes, keys, rssi):
+        return self.classify(self.smooth(codes, keys, rssi))
+
+    def filter_rows(self, rows):
+        """
+        Keeps the upload_parser.ContactRow records within max_distance, smoothing per
+        sender_id/manufacturer_data pair (pair_keys). Returns (kept rows, number dropped).
+        """
+        if not rows:
+            return rows, 0
+        _, _, rssi, _, manufacturer_data, sender_id = zip(*rows)
+        keys, codes = np.unique(pair_keys(sender_id, manufacturer_data), return_inverse=True)
+        keep = self.near(codes, keys.tolist(), rssi_values(rssi))
+        kept = list(compress(rows, keep.tolist()))
+        return kept, len(rows) - len(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit RSSI path loss models from the distance calibration readings")
+    parser.add_argument('--calibration-file', default=CALIBRATION_FILE)
+    parser.add_argument('--max-distance', type=float, default=MAX_CONTACT_DISTANCE)
+    args = parser.parse_args()
+
+    print(f"{'environment':<16}{'RSSI@1m':>9}{'exponent':>10}{'readings':>10}{'RMSE':>7}"
+          f"{f'RSSI@{args.max_distance:g}m':>10}{'-70 dBm':>10}")
+    for environment, model in sorted(load_calibration(args.calibration_file).items()):
+        print(f"{environment:<16}{model.rssi_at_ref:>9.1f}{model.exponent:>10.2f}{model.samples:>10}{model.rmse:>7.1f}"
+              f"{float(model.rssi_at(args.max_distance)):>10.1f}{float(model.distance(-70)):>9.1f}m")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+DEDUP_MAX_DEVICES = 100000   # devices whose last upload is remembered, least recently seen are forgotten first
+DEDUP_TTL_SECONDS = 3600     # a retry arriving later than this is processed again
+DEDUP_MODES = ('rows', 'off')
+
+# What is remembered of a device's last accepted upload
+LastUpload = namedtuple('LastUpload', 'digest row_hashes expiry')
+
+
+def body_hasher():
+    """Incremental hash of a raw request body, fed chunk by chunk while it is parsed"""
+    return hashlib.blake2b(digest_size=16)
+
+
+class UploadDeduplicator:
+    """
+    Drops rows a device already uploaded. The firmware clears its log only once a
+    POST gets a response, so after a lost acknowledgement its next upload resends
+    every row of the previous one followed by the rows scanned since, under a new
+    X-Timestamp. Such a retry is cumulative, so its old rows are all in the last
+    upload the server accepted from that device. Per X-Device-ID this remembers
+    that upload's body digest, so an identical resend is acknowledged without
+    being stored again, and its row hashes, so only the new rows of a longer one
+    are kept. Uploads without a device ID fall back to the body digest alone:
+    each accepted body is remembered under its digest, and only an identical
+    one counts as a resend. Entries are forgotten after ttl seconds, the least
+    recently seen first past max_devices.
+    """
+    def __init__(self, max_devices=DEDUP_MAX_DEVICES, ttl=DEDUP_TTL_SECONDS):
+        self.max_devices = max_devices
+        self.ttl = ttl
+        self._devices = OrderedDict()  # device_id, or (None, digest) -> LastUpload, least recently seen first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    @staticmethod
+    def _key(device_id, digest):
+        return device_id if device_id else (None, digest)
+
+    def _last(self, key, now):
+        last = self._devices.get(key)
+        return last if last is not None and last.expiry > now else None
+
+    def is_resend(self, device_id, digest, now=None):
+        """True if digest is the body of device_id's last accepted upload (any recent one without an ID)"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            last = self._last(self._key(device_id, digest), now)
+            return last is not None and last.digest == digest
+
+    def claim(self, device_id, digest, rows, now=None):
+        """
+        Records rows as device_id's last upload. Returns (the rows that were not in
+        its previous upload, a token for release()).
+        """
+        if now is None:
+            now = time.monotonic()
+        key = self._key(device_id, digest)
+        # Without a device ID there is no previous upload to compare rows with
+        hashes = [hash(row) for row in rows] if device_id else []
+        upload = LastUpload(digest, frozenset(hashes), now + self.ttl)
+        with self._lock:
+            previous = self._last(key, now)
+            self._devices[key] = upload
+            self._devices.move_to_end(key)
+            # Entries share one TTL, so the oldest are at the front
+            while self._devices:
+                oldest_id, oldest = next(iter(self._devices.items()))
+                if oldest.expiry > now and len(self._devices) <= self.max_devices:
+                    break
+                del self._devices[oldest_id]
+        if previous is not None:
+            if not device_id:
+                rows = []
+            else:
+                seen = previous.row_hashes
+                rows = [row for row, row_hash in zip(rows, hashes) if row_hash not in seen]
+        return rows, (key, previous, upload)
+
+    def release(self, token):
+        """Undoes a claim() whose rows were not stored, unless the device has uploaded since"""
+        key, previous, upload = token
+        with self._lock:
+            if self._devices.get(key) is not upload:
+                return
+            if previous is None:
+                del self._devices[key]
+            else:
+                self._devices[key] = previous
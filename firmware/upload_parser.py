@@ -0,0 +1,285 @@
+import csv
+import io
+import struct
+import zlib
+from collections import namedtuple
+from itertools import islice
+from operator import itemgetter
+
+# Column order of the CSV rows written by firmware.ino
+UPLOAD_FIELDS = ('timestamp', 'device_address', 'rssi', 'device_name', 'manufacturer_data', 'sender_id')
+
+# One parsed detection. A namedtuple keeps rows as compact tuples instead of per-row dicts
+ContactRow = namedtuple('ContactRow', UPLOAD_FIELDS)
+
+# Values used when a column is missing from the upload, matching the old DictReader defaults
+FIELD_DEFAULTS = ContactRow(timestamp='Unknown', device_address='', rssi='Unknown',
+                            device_name='Unknown', manufacturer_data='', sender_id='Unknown')
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Binary uploads, sent with Content-Type: application/x-ble-contacts. Layout (little-endian):
+#   b'BLC1', u16 name count, then per name u8 length + UTF-8 bytes,
+#   then fixed 17-byte records: i32 timestamp, 6-byte device address, i8 rssi,
+#   u8 name index (0xFF = no name), u16 manufacturer_data, u16 sender_id, u8 flags
+BINARY_CONTENT_TYPE = 'application/x-ble-contacts'
+BINARY_MAGIC = b'BLC1'
+BINARY_RECORD = struct.Struct('<i6sbBHHB')
+NO_NAME = 0xFF
+FLAG_NO_MANUFACTURER_DATA = 0x01
+FLAG_NO_SENDER_ID = 0x02
+
+# Content-Encoding values accepted for either format, and the cap on the decoded size
+CONTENT_ENCODINGS = ('identity', 'gzip', 'deflate')
+MAX_DECODED_BYTES = 64 * 1024 * 1024
+
+# An upload's rows are all kept until it is applied as a whole, so these cap its memory.
+# The firmware's log lives in SPIFFS (a few MB), so real uploads stay well below them
+MAX_UPLOAD_ROWS = 100000
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """An upload over the row, body or decoded size cap (answered with 413, not 400)"""
+
+
+class BoundedBodyReader(io.RawIOBase):
+    """
+    Raw stream over exactly content_length bytes of a request body. Each chunk
+    read is also passed to on_chunk, so the raw upload can be hashed while it is parsed.
+    """
+    def __init__(self, stream, content_length, on_chunk=None):
+        self._stream = stream
+        self._remaining = content_length
+        self._on_chunk = on_chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._remaining <= 0:
+            return 0
+        chunk = self._stream.read(min(len(buffer), self._remaining, READ_CHUNK_SIZE))
+        if not chunk:
+            # Client closed the connection early
+            self._remaining = 0
+            return 0
+        n = len(chunk)
+        buffer[:n] = chunk
+        self._remaining -= n
+        if self._on_chunk is not None:
+            self._on_chunk(chunk)
+        return n
+
+
+def parse_schema(schema):
+    """Turns a declared schema such as an X-Schema header value into a tuple of column names"""
+    if not schema:
+        return None
+    return tuple(column.strip() for column in schema.split(','))
+
+
+def _row_builder(columns):
+    """Returns a function mapping a csv.reader row with the given columns to a ContactRow"""
+    indices = [columns.index(field) if field in columns else None for field in UPLOAD_FIELDS]
+
+    if None not in indices:
+        # Fast path: every field is present, pick them out and strip in one pass
+        getter = itemgetter(*indices)
+        needed = max(indices) + 1
+
+        def build(row):
+            if len(row) >= needed:
+                return ContactRow._make(map(str.strip, getter(row)))
+            return _build_padded(row)
+    else:
+        def build(row):
+            return _build_padded(row)
+
+    def _build_padded(row):
+        return ContactRow._make(
+            row[i].strip() if i is not None and i < len(row) else default
+            for i, default in zip(indices, FIELD_DEFAULTS)
+        )
+
+    return build
+
+
+def iter_contact_rows(text_stream, schema=None):
+    """
+    Yields ContactRow records from a text stream of upload CSV, one line at a time.
+    When the device declares its schema the header check is skipped; otherwise a
+    leading 'timestamp,...' line is used as the header and later header lines are dropped.
+    """
+    reader = csv.reader(text_stream)
+    if schema:
+        build = _row_builder(schema)
+        for row in reader:
+            if row:
+                yield build(row)
+        return
+
+    build = _row_builder(UPLOAD_FIELDS)
+    first = True
+    for row in reader:
+        if not row:
+            continue
+        if row[0].startswith('timestamp'):
+            if first:
+                build = _row_builder(tuple(column.strip() for column in row))
+            first = False
+            continue
+        first = False
+        yield build(row)
+
+
+def _collect_rows(rows, max_rows):
+    """list(rows), raising UploadTooLarge as soon as there are more than max_rows (0 for no cap)"""
+    if not max_rows:
+        return list(rows)
+    collected = list(islice(rows, max_rows + 1))
+    if len(collected) > max_rows:
+        raise UploadTooLarge(f"Upload has more than {max_rows} rows")
+    return collected
+
+
+def parse_upload_stream(stream, content_length, schema=None, on_chunk=None, max_rows=MAX_UPLOAD_ROWS):
+    """
+    Reads and parses a request body incrementally, returning a list of ContactRow records.
+    The body is never held as bytes or str. The rows of one upload are all kept, so an
+    upload is applied or rejected as a whole, and reading stops with UploadTooLarge
+    once there are more than max_rows of them.
+    """
+    body = BoundedBodyReader(stream, content_length, on_chunk)
+    text = io.TextIOWrapper(io.BufferedReader(body, READ_CHUNK_SIZE), encoding='utf-8', newline='')
+    return _collect_rows(iter_contact_rows(text, schema), max_rows)
+
+
+def parse_upload_text(csv_data, schema=None):
+    """Parses an already decoded upload body"""
+    return list(iter_contact_rows(io.StringIO(csv_data, newline=''), schema))
+
+
+def _hex_ids():
+    """'%04X' for every 16-bit ID, built on the first binary upload (about 4 MB)"""
+    global _HEX_IDS
+    if _HEX_IDS is None:
+        _HEX_IDS = ['%04X' % value for value in range(0x10000)]
+    return _HEX_IDS
+
+
+_HEX_IDS = None
+
+
+def parse_binary_upload(data, max_rows=0):
+    """
+    Parses a BINARY_CONTENT_TYPE body into ContactRow records. Timestamps and
+    RSSI stay ints; the 16-bit IDs become the same 4-digit upper-case hex the
+    CSV carries, looked up rather than formatted per row. More than max_rows
+    records (if set) raise UploadTooLarge before any row is built.
+    """
+    view = memoryview(data)
+    if len(view) < 6 or view[:4] != BINARY_MAGIC:
+        raise ValueError("Binary upload does not start with " + BINARY_MAGIC.decode())
+    (name_count,) = struct.unpack_from('<H', view, 4)
+    offset = 6
+    names = []
+    for _ in range(name_count):
+        if offset >= len(view):
+            raise ValueError("Binary upload name table is truncated")
+        length = view[offset]
+        names.append(str(view[offset + 1:offset + 1 + length], 'utf-8'))
+        offset += 1 + length
+    records = view[offset:]
+    if len(records) % BINARY_RECORD.size:
+        raise ValueError(f"Binary upload records are not a multiple of {BINARY_RECORD.size} bytes")
+    if max_rows and len(records) // BINARY_RECORD.size > max_rows:
+        raise UploadTooLarge(f"Upload has more than {max_rows} rows")
+
+    # Indexes past the table, including NO_NAME, read as the CSV default
+    names += [FIELD_DEFAULTS.device_name] * (NO_NAME + 1 - len(names))
+    hex_ids = _hex_ids()
+    make = ContactRow._make
+    return [
+        make((timestamp, address.hex(':'), rssi, names[name_index], hex_ids[manufacturer], hex_ids[sender]))
+        if not flags else
+        make((timestamp, address.hex(':'), rssi, names[name_index],
+              'None' if flags & FLAG_NO_MANUFACTURER_DATA else hex_ids[manufacturer],
+              'None' if flags & FLAG_NO_SENDER_ID else hex_ids[sender]))
+        for timestamp, address, rssi, name_index, manufacturer, sender, flags in BINARY_RECORD.iter_unpack(records)
+    ]
+
+
+def encode_binary_upload(rows):
+    """Encodes ContactRow-like rows as a BINARY_CONTENT_TYPE body (used by load_generator.py)"""
+    names = {}
+    records = []
+    for timestamp, address, rssi, device_name, manufacturer_data, sender_id in rows:
+        flags = 0
+        if manufacturer_data in ('', 'None', None):
+            flags |= FLAG_NO_MANUFACTURER_DATA
+            manufacturer_data = '0'
+        if sender_id in ('', 'None', 'Unknown', None):
+            flags |= FLAG_NO_SENDER_ID
+            sender_id = '0'
+        if device_name in ('', 'Unknown', None):
+            name_index = NO_NAME
+        else:
+            name_index = names.setdefault(device_name, len(names))
+            if name_index >= NO_NAME:
+                raise ValueError(f"Binary uploads hold at most {NO_NAME} distinct device names")
+        address_bytes = bytes.fromhex(address.replace(':', '')) if address else bytes(6)
+        records.append(BINARY_RECORD.pack(int(timestamp), address_bytes, int(rssi), name_index,
+                                          int(manufacturer_data, 16), int(sender_id, 16), flags))
+    header = [BINARY_MAGIC, struct.pack('<H', len(names))]
+    for name in names:
+        encoded = name.encode('utf-8')[:255]
+        header.append(bytes((len(encoded),)) + encoded)
+    return b''.join(header + records)
+
+
+def decode_body(data, content_encoding):
+    """Undoes a gzip or deflate Content-Encoding, refusing bodies that inflate past MAX_DECODED_BYTES"""
+    if content_encoding in (None, '', 'identity'):
+        return data
+    if content_encoding == 'gzip':
+        wbits = 16 + zlib.MAX_WBITS
+    elif content_encoding == 'deflate':
+        # HTTP deflate is meant to be zlib-wrapped, but some clients send a raw stream
+        wrapped = len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0
+        wbits = zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS
+    else:
+        raise ValueError(f"Unsupported Content-Encoding '{content_encoding}'")
+    decompressor = zlib.decompressobj(wbits)
+    try:
+        decoded = decompressor.decompress(data, MAX_DECODED_BYTES)
+    except zlib.error as e:
+        raise ValueError(f"Corrupt {content_encoding} body: {e}") from None
+    if decompressor.unconsumed_tail:
+        raise UploadTooLarge(f"Upload inflates to more than {MAX_DECODED_BYTES} bytes")
+    if not decompressor.eof:
+        raise ValueError(f"Truncated {content_encoding} body")
+    return decoded
+
+
+def parse_upload(stream, content_length, content_type=None, content_encoding=None, schema=None,
+                 max_rows=MAX_UPLOAD_ROWS, on_chunk=None):
+    """
+    Parses a request body of either format. Plain CSV is parsed while it is read;
+    binary or compressed bodies are read whole first. on_chunk gets the raw body
+    bytes as they are read, e.g. to hash it without keeping it. Raises ValueError (including
+    UnicodeDecodeError, and csv.Error re-raised as ValueError) for bodies that cannot be
+    parsed, and its subclass UploadTooLarge past max_rows rows or MAX_DECODED_BYTES.
+    """
+    binary = content_type == BINARY_CONTENT_TYPE
+    try:
+        if not binary and content_encoding in (None, '', 'identity'):
+            return parse_upload_stream(stream, content_length, schema, on_chunk, max_rows)
+        data = decode_body(BoundedBodyReader(stream, content_length, on_chunk).readall(), content_encoding)
+        if binary:
+            return parse_binary_upload(data, max_rows)
+        text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', newline='')
+        return _collect_rows(iter_contact_rows(text, schema), max_rows)
+    except csv.Error as e:
+        # e.g. a field longer than csv.field_size_limit() or a stray NUL byte
+        raise ValueError(f"Malformed CSV: {e}") from None
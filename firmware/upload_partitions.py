@@ -0,0 +1,169 @@
+import csv
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from ingest_log import get_logger
+
+log = get_logger("storage")
+
+UPLOAD_WINDOW_SECONDS = 3600          # one file per device per hour
+UPLOAD_MAX_BYTES = 64 * 1024 * 1024   # a window's file is rotated early once it reaches this size
+UPLOAD_MAX_OPEN_FILES = 1024          # one per device for several hundred tracers; least recently used are closed beyond
+FD_HEADROOM = 256                     # descriptors left for sockets, journals and the processed data files
+UNKNOWN_DEVICE = "unknown"
+RESERVED_PARTITIONS = ('columnar',)   # directories under UPLOAD_DIR that are not devices
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def device_partition(device_id):
+    """
+    Directory name for an X-Device-ID value; anything outside [A-Za-z0-9_.-] becomes '_',
+    and an ID naming one of RESERVED_PARTITIONS gets a leading '_'
+    """
+    if not device_id:
+        return UNKNOWN_DEVICE
+    name = _UNSAFE_CHARS.sub('_', device_id.strip())[:64].lstrip('.')
+    if name.lower() in RESERVED_PARTITIONS:
+        return '_' + name
+    return name or UNKNOWN_DEVICE
+
+
+def open_file_limit(wanted):
+    """
+    How many upload files can stay open under the process's descriptor limit, after
+    raising the soft limit towards wanted + FD_HEADROOM where the hard limit allows
+    """
+    try:
+        import resource
+    except ImportError:
+        # Not on Windows, whose C runtime limit is well above the default
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = wanted + FD_HEADROOM
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError) as e:
+            log.warning("nofile_limit_unchanged soft=%d wanted=%d error=%s", soft, needed, e)
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(1, min(wanted, soft - FD_HEADROOM))
+
+
+class _Partition:
+    __slots__ = ('directory', 'lock', 'file', 'writer', 'window', 'path', 'users')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.file = None
+        self.writer = None
+        self.window = None
+        self.path = None
+        self.users = 0      # uploads holding it, counted under the pool lock
+
+
+class PartitionedUploadWriter:
+    """
+    Appends raw upload rows to <directory>/<device>/upload_<window start>.csv,
+    one file per device and time window, each starting with its own header.
+    A file that reaches max_bytes is continued in upload_<window start>_<n>.csv.
+
+    Open files are kept in an LRU pool of at most max_open handles, so a device
+    uploading every few seconds reuses its handle instead of reopening the file.
+    Rows are flushed after every upload. Uploads from different devices only
+    share the pool lock, which is held for the lookup. Only partitions no upload
+    is using are evicted, so a device's file always has one partition and one
+    lock; the pool can briefly exceed max_open while every partition is busy.
+    """
+    def __init__(self, directory, header, window_seconds=UPLOAD_WINDOW_SECONDS,
+                 max_bytes=UPLOAD_MAX_BYTES, max_open=UPLOAD_MAX_OPEN_FILES):
+        self.directory = directory
+        self.header = list(header)
+        self.window_seconds = window_seconds
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write_rows(self, device_id, rows, received_at=None):
+        """Appends one upload's rows to the device's file for the window received_at falls in; returns its path"""
+        if received_at is None:
+            received_at = datetime.now()
+        window = int(received_at.timestamp()) // self.window_seconds * self.window_seconds
+        partition = self._acquire(device_partition(device_id))
+        try:
+            with partition.lock:
+                if partition.file is not None and (partition.window != window or partition.file.tell() >= self.max_bytes):
+                    self._close(partition)
+                if partition.file is None:
+                    self._open(partition, window)
+                partition.writer.writerows(rows)
+                partition.file.flush()
+                return partition.path
+        finally:
+            with self._lock:
+                partition.users -= 1
+
+    def close(self):
+        with self._lock:
+            partitions = list(self._partitions.values())
+            self._partitions.clear()
+        for partition in partitions:
+            with partition.lock:
+                self._close(partition)
+
+    def _acquire(self, name):
+        """The device's partition, marked in use; idle ones beyond max_open are evicted"""
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is None:
+                partition = self._partitions[name] = _Partition(os.path.join(self.directory, name))
+            else:
+                self._partitions.move_to_end(name)
+            partition.users += 1
+            evicted = []
+            excess = len(self._partitions) - self.max_open
+            if excess > 0:
+                for old_name, old in self._partitions.items():
+                    if len(evicted) == excess:
+                        break
+                    if not old.users:
+                        evicted.append(old_name)
+                evicted = [self._partitions.pop(old_name) for old_name in evicted]
+        # Out of the pool and unused, so nothing else can reach these any more
+        for old in evicted:
+            with old.lock:
+                self._close(old)
+        return partition
+
+    def _open(self, partition, window):
+        os.makedirs(partition.directory, exist_ok=True)
+        stamp = datetime.fromtimestamp(window).strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(partition.directory, f"upload_{stamp}.csv")
+        suffix = 1
+        # Continue a file from an earlier run in the same window unless it is already full
+        while os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+            path = os.path.join(partition.directory, f"upload_{stamp}_{suffix}.csv")
+            suffix += 1
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        partition.file = open(path, 'a', newline='', buffering=256 * 1024)
+        partition.writer = csv.writer(partition.file)
+        partition.window = window
+        partition.path = path
+        if new_file:
+            partition.writer.writerow(self.header)
+            log.debug("upload_file_opened path=%s", path)
+
+    @staticmethod
+    def _close(partition):
+        if partition.file is not None:
+            partition.file.close()
+            partition.file = None
+            partition.writer = None
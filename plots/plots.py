@@ -1,8 +1,12 @@
 import os
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'firmware'))
+from rssi_calibration import load_calibration, POOLED_ENVIRONMENT, MIN_FIT_DISTANCE
+
 
 plots_dir = os.path.join("./", "plots")
 
@@ -10,12 +14,21 @@ def main():
     generate_rssi_distance()
 
 # Creates the graph for rssi vs distance, highlights different conditions with colours
+# and overlays the path loss model fitted for each one (see firmware/rssi_calibration.py)
 def generate_rssi_distance():
-    df = pd.read_csv(os.path.join(plots_dir, 'rssi_vs_distance.csv'))
+    csv_path = os.path.join(plots_dir, 'rssi_vs_distance.csv')
+    df = pd.read_csv(csv_path)
+    models = load_calibration(csv_path)
+    distances = np.linspace(MIN_FIT_DISTANCE, df['distance'].max(), 200)
 
     conditions = df.groupby('environment')
     for condition, group in conditions:
-        plt.scatter(group['distance'], group['rssi'], label=condition)
+        points = plt.scatter(group['distance'], group['rssi'], label=condition)
+        model = models[condition]
+        plt.plot(distances, model.rssi_at(distances), color=points.get_facecolor()[0], alpha=0.6,
+                 label=f"{condition} fit (n={model.exponent:.2f})")
+    pooled = models[POOLED_ENVIRONMENT]
+    plt.plot(distances, pooled.rssi_at(distances), 'k--', alpha=0.6, label=f"all fit (n={pooled.exponent:.2f})")
 
     plt.legend(title="Environment")
     plt.xlabel("Distance (m)")